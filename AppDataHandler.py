@@ -1,4 +1,8 @@
 import os
+import sqlite3
+import threading
+import time
+from types import MappingProxyType
 
 import appdirs
 import json
@@ -8,7 +12,9 @@ class DataHandler:
     application_name = "Music Maker"
     author = "Jocwae"
     file_name = "preferences.json"
-    cache_name = "cache.json"
+    cache_name = "cache.sqlite3"
+    legacy_cache_name = "cache.json"
+    partial_download_folder_name = "partial"
 
     # Identifiers
     folder_key = "FOLDER"
@@ -18,6 +24,13 @@ class DataHandler:
     sim_process_key = "SIMULTANEOUS_PROCESSES"
     audio_only_key = "AUDIO_ONLY"
     stream_limit_key = "STREAM_LIMIT"
+    stream_remux_key = "STREAM_REMUX"
+    download_segments_key = "DOWNLOAD_SEGMENTS"
+    download_as_discovered_key = "DOWNLOAD_AS_DISCOVERED"
+    async_downloads_key = "ASYNC_DOWNLOADS"
+    # In KiB/s. (0 = unlimited)
+    bandwidth_limit_key = "BANDWIDTH_LIMIT"
+    adaptive_downloads_key = "ADAPTIVE_DOWNLOADS"
 
     __default_application_settings = {
         url_key: "",
@@ -26,10 +39,29 @@ class DataHandler:
         sim_download_key: 1,
         sim_process_key: 1,
         audio_only_key: True,
-        stream_limit_key: 0
+        stream_limit_key: 0,
+        stream_remux_key: False,
+        download_segments_key: 1,
+        download_as_discovered_key: False,
+        async_downloads_key: False,
+        bandwidth_limit_key: 0,
+        adaptive_downloads_key: False
     }
 
+    # Oldest cache entries are evicted past this many entries.
+    cache_max_entries = 50000
+    # Number of cache writes between size checks.
+    cache_eviction_interval = 100
+
+    # Cache database.
+    __cache_connection: sqlite3.Connection = None
+    __cache_lock = threading.RLock()
+    __cache_writes_since_eviction = 0
+    # Keys read since the last write, whose access times are updated with the next write.
+    __cache_pending_accesses: set[str] = set()
+
     # Cached data.
+    __config_lock = threading.RLock()
     __cached_data_updated = False
     __cached_application_settings = {
         url_key: "",
@@ -38,7 +70,13 @@ class DataHandler:
         sim_download_key: 1,
         sim_process_key: 1,
         audio_only_key: True,
-        stream_limit_key: 0
+        stream_limit_key: 0,
+        stream_remux_key: False,
+        download_segments_key: 1,
+        download_as_discovered_key: False,
+        async_downloads_key: False,
+        bandwidth_limit_key: 0,
+        adaptive_downloads_key: False
     }
 
     @classmethod
@@ -85,46 +123,103 @@ class DataHandler:
             print("Unable to parse config file.")
             return cls.__default_application_settings
 
+    @classmethod
+    def get_cache_dir(cls) -> str:
+        return appdirs.user_cache_dir(cls.application_name, cls.author)
+
     @classmethod
     def get_cache_path(cls) -> str:
-        return (os.path.join(
-            appdirs.user_cache_dir(cls.application_name, cls.author),
-            cls.cache_name))
+        return os.path.join(cls.get_cache_dir(), cls.cache_name)
 
     @classmethod
-    def get_cache_file_info(cls) -> dict:
-        """Gets the json in the configuration file."""
+    def get_partial_download_dir(cls) -> str:
+        """Folder that part files of unfinished downloads are kept in."""
+        return os.path.join(cls.get_cache_dir(), cls.partial_download_folder_name)
+
+    @classmethod
+    def get_cache_connection(cls) -> sqlite3.Connection:
+        """Opens the cache database the first time it is needed. Must be called with the cache lock held."""
+        if cls.__cache_connection is not None:
+            return cls.__cache_connection
+
+        os.makedirs(cls.get_cache_dir(), exist_ok=True)
         path = cls.get_cache_path()
+        print(f"Opening cache database at '{path}'.")
+
+        connection = sqlite3.connect(path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, accessed REAL NOT NULL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        connection.commit()
+        cls.__cache_connection = connection
+
+        cls.import_legacy_cache_file()
+        return connection
+
+    @classmethod
+    def import_legacy_cache_file(cls):
+        """Moves the entries of the old json cache file into the cache database."""
+        path = os.path.join(cls.get_cache_dir(), cls.legacy_cache_name)
+        if not os.path.exists(path):
+            return
 
         try:
-            if not os.path.exists(path):
-                print(f"No cache file exists at '{path}'.")
-                return {}
-            else:
-                with open(path, "r") as file:
-                    print(f"Found cache file at '{path}'")
-                    return json.load(file)
+            with open(path, "r") as file:
+                print(f"Importing cache file at '{path}'")
+                cls.update_cache_entries(json.load(file))
         except json.JSONDecodeError:
             print("Unable to parse cache file.")
-            return {}
+
+        os.remove(path)
+
+    @classmethod
+    def get_cache_file_info(cls) -> dict:
+        """Gets every entry in the cache."""
+        with cls.__cache_lock:
+            rows = cls.get_cache_connection().execute("SELECT key, value FROM cache").fetchall()
+
+        return {key: json.loads(value) for key, value in rows}
 
     @classmethod
     def update_config_file(cls, key: str, value):
         """Updates or adds a value in the configuration file."""
+        cls.update_config_entries({key: value})
+
+    @classmethod
+    def update_config_entries(cls, entries: dict):
+        """Updates or adds every value in the configuration file with a single write."""
         path = cls.get_file_path()
 
-        existing_json = cls.get_config_file_info()
-        existing_json[key] = value
-        cls.__cached_application_settings = existing_json
-        cls.__cached_data_updated = True
+        with cls.__config_lock:
+            existing_json = dict(cls.get_config_file_info())
+            existing_json.update(entries)
 
-        if not os.path.exists(path):
             os.makedirs(appdirs.user_data_dir(cls.application_name, cls.author), exist_ok=True)
-            with open(path, "w") as file:
-                file.write("{}")
 
-        with open(path, "w") as file:
-            json.dump(existing_json, file)
+            # Write to a temporary file first so the configuration file is never left half written.
+            temp_path = path + ".tmp"
+            with open(temp_path, "w") as file:
+                json.dump(existing_json, file)
+            os.replace(temp_path, path)
+
+            cls.__cached_application_settings = existing_json
+            cls.__cached_data_updated = True
+
+    @classmethod
+    def get_config_snapshot(cls, overrides: dict = None) -> MappingProxyType:
+        """
+        Gets a read-only copy of the configuration that later updates don't change.
+        :param overrides: Values to use instead of the ones in the configuration file.
+        :return: The configuration.
+        """
+        with cls.__config_lock:
+            settings = dict(cls.get_config_file_info())
+
+        if overrides is not None:
+            settings.update(overrides)
+        return MappingProxyType(settings)
 
     @classmethod
     def retrieve_config_file_info(cls, key: str):
@@ -140,21 +235,51 @@ class DataHandler:
     @classmethod
     def update_cache_file(cls, key: str, value):
         """Adds or updates the value in the cache file."""
-        path = cls.get_cache_path()
+        cls.update_cache_entries({key: value})
 
-        existing_json = cls.get_cache_file_info()
-        existing_json[key] = value
+    @classmethod
+    def update_cache_entries(cls, entries: dict):
+        """Adds or updates every value in the cache in one transaction."""
+        now = time.time()
+        rows = [(key, json.dumps(value), now) for key, value in entries.items()]
+
+        with cls.__cache_lock:
+            connection = cls.get_cache_connection()
+            with connection:
+                connection.executemany("INSERT OR REPLACE INTO cache (key, value, accessed) VALUES (?, ?, ?)", rows)
+                if len(cls.__cache_pending_accesses) > 0:
+                    connection.executemany("UPDATE cache SET accessed = ? WHERE key = ?",
+                                           [(now, key) for key in cls.__cache_pending_accesses])
+                    cls.__cache_pending_accesses.clear()
+
+            cls.__cache_writes_since_eviction += len(rows)
+            if cls.__cache_writes_since_eviction >= cls.cache_eviction_interval:
+                cls.__cache_writes_since_eviction = 0
+                cls.evict_cache_entries()
+
+    @classmethod
+    def evict_cache_entries(cls):
+        """Deletes the least recently used entries past cache_max_entries."""
+        with cls.__cache_lock:
+            connection = cls.get_cache_connection()
+            count = connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            if count <= cls.cache_max_entries:
+                return
 
-        with open(path, "w") as file:
-            json.dump(existing_json, file)
+            print(f"Evicting {count - cls.cache_max_entries} cache entries.")
+            with connection:
+                connection.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed LIMIT ?)",
+                    (count - cls.cache_max_entries,))
 
     @classmethod
     def retrieve_cache_file_info(cls, key: str):
         """Retrieves information from the cache file.
         Returns None if the key does not exist."""
-        file_info = cls.get_cache_file_info()
+        with cls.__cache_lock:
+            row = cls.get_cache_connection().execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            cls.__cache_pending_accesses.add(key)
 
-        if key not in file_info:
-            return None
-        else:
-            return file_info[key]
+        return json.loads(row[0])
@@ -0,0 +1,450 @@
+import asyncio
+import threading
+import time
+import traceback
+from contextlib import aclosing
+from concurrent.futures.thread import ThreadPoolExecutor
+from typing import AsyncIterator, Final, Mapping
+from urllib.parse import urlsplit, urljoin
+from uuid import uuid4
+
+from pytube import Stream, StreamQuery, YouTube
+
+from BandwidthLimiter import BandwidthLimiter
+from DownloadEngine import DownloadEngine, DownloadJob
+from DownloadHelpers import DownloadRequestArgs, DownloadErrorCode, FetchedDownload, \
+    ProgressReporter, RANGE_SIZE, CHUNK_SIZE, REQUEST_TIMEOUT, REQUEST_HEADERS, metadata_executor, \
+    get_track_details, send_event, handle_stream_error_code, close_fetched_download, process_download, \
+    finish_download
+from HttpPool import PoolStats
+from LibraryIndex import LibraryIndex
+from PartialDownloads import PartialDownload
+
+MAX_REDIRECTS: Final[int] = 5
+
+
+async def read_response_head(reader: asyncio.StreamReader) -> tuple[int, dict[str, str]]:
+    """
+    Reads the status line and headers of an HTTP/1.1 response.
+    :return: The status code and the headers with lowercase names.
+    """
+    status_line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+    parts = status_line.decode("latin-1").split(" ", 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+        raise ConnectionError(f"Invalid response '{status_line!r}'.")
+
+    headers = {}
+    while True:
+        line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    return int(parts[1]), headers
+
+
+async def read_body(reader: asyncio.StreamReader, headers: dict[str, str]) -> AsyncIterator[bytes]:
+    """Yields the body of a response in chunks of at most CHUNK_SIZE bytes."""
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size_line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+            size = int(size_line.split(b";", 1)[0], 16)
+            if size == 0:
+                # Trailers end with a blank line, which has to be read before the connection can be reused.
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+                    if line in (b"\r\n", b"\n", b""):
+                        return
+            remaining = size
+            while remaining > 0:
+                chunk = await asyncio.wait_for(reader.read(min(CHUNK_SIZE, remaining)), REQUEST_TIMEOUT)
+                if not chunk:
+                    raise ConnectionError("Connection closed in the middle of a chunk.")
+                remaining -= len(chunk)
+                yield chunk
+            await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+
+    length = int(headers["content-length"]) if "content-length" in headers else None
+    while length is None or length > 0:
+        chunk = await asyncio.wait_for(reader.read(CHUNK_SIZE if length is None else min(CHUNK_SIZE, length)),
+                                       REQUEST_TIMEOUT)
+        if not chunk:
+            if length is not None:
+                raise ConnectionError(f"Connection closed with {length} bytes left.")
+            return
+        if length is not None:
+            length -= len(chunk)
+        yield chunk
+
+
+class AsyncHttpPool:
+    """
+    Keep-alive connections for the requests of one event loop. A connection goes back to its host's idle list once
+    its response has been read to the end, so the range requests of a stream skip the TCP and TLS handshakes.
+    Only used from the loop's thread, so it needs no locks.
+    """
+    # Idle connections kept for one host. Further connections are closed when their response ends.
+    MAX_IDLE_PER_HOST: Final[int] = 16
+    # Idle connections older than this are closed instead of reused, in seconds.
+    IDLE_TIMEOUT: Final[float] = 60.0
+
+    def __init__(self):
+        # (host, port, secure) -> idle connections and the time they were returned.
+        self.idle: dict[tuple[str, int, bool], list[tuple[asyncio.StreamReader, asyncio.StreamWriter, float]]] = {}
+        self.requests = 0
+        self.connections_opened = 0
+        self.connections_reused = 0
+
+    async def connect(self, address: tuple[str, int, bool],
+                      reuse: bool = True) -> tuple[asyncio.StreamReader, asyncio.StreamWriter, bool]:
+        """
+        Takes an idle connection to the address, or opens a new one.
+        :param address: (host, port, secure)
+        :param reuse: False to always open a new connection.
+        :return: The reader and writer of the connection, and True if it was reused.
+        """
+        self.requests += 1
+        connections = self.idle.get(address, [])
+        now = time.monotonic()
+        while reuse and len(connections) > 0:
+            reader, writer, idle_since = connections.pop()
+            if now - idle_since < self.IDLE_TIMEOUT and not reader.at_eof() and not writer.is_closing():
+                self.connections_reused += 1
+                return reader, writer, True
+            writer.close()
+
+        host, port, secure = address
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port, ssl=secure or None),
+                                                REQUEST_TIMEOUT)
+        self.connections_opened += 1
+        return reader, writer, False
+
+    def release(self, address: tuple[str, int, bool], reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Returns a connection whose response was read to the end."""
+        connections = self.idle.setdefault(address, [])
+        if len(connections) >= self.MAX_IDLE_PER_HOST:
+            writer.close()
+            return
+        connections.append((reader, writer, time.monotonic()))
+
+    def close(self):
+        """Closes every idle connection."""
+        for connections in self.idle.values():
+            for _, writer, _ in connections:
+                writer.close()
+        self.idle.clear()
+
+    def get_stats(self) -> PoolStats:
+        return PoolStats(self.requests, self.connections_opened, self.connections_reused)
+
+
+async def send_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                       request: bytes) -> tuple[int, dict[str, str]]:
+    """Sends the request and reads the head of the response."""
+    writer.write(request)
+    await writer.drain()
+    return await read_response_head(reader)
+
+
+async def request_async(url: str, pool: AsyncHttpPool) -> AsyncIterator[bytes]:
+    """
+    Streams the body of a GET request without blocking the event loop. Follows redirects.
+    :param url: The url to request.
+    :param pool: Connections to reuse. The connection goes back to it if the body is read to the end.
+    :return: The body in chunks.
+    """
+    for _ in range(MAX_REDIRECTS + 1):
+        parts = urlsplit(url)
+        secure = parts.scheme == "https"
+        address = (parts.hostname, parts.port or (443 if secure else 80), secure)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        headers = {"Host": parts.netloc, **REQUEST_HEADERS, "Accept-Encoding": "identity"}
+        request = f"GET {target} HTTP/1.1\r\n" + "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+
+        reader, writer, reused = await pool.connect(address)
+        reusable = False
+        try:
+            try:
+                status, response_headers = await send_request(reader, writer, (request + "\r\n").encode("latin-1"))
+            except (ConnectionError, OSError, asyncio.IncompleteReadError):
+                if not reused:
+                    raise
+                # The server closed the idle connection, so the request is sent again on a new one.
+                writer.close()
+                reader, writer, _ = await pool.connect(address, reuse=False)
+                status, response_headers = await send_request(reader, writer, (request + "\r\n").encode("latin-1"))
+
+            if status in (301, 302, 303, 307, 308) and "location" in response_headers:
+                url = urljoin(url, response_headers["location"])
+                continue
+            if status not in (200, 206):
+                raise ConnectionError(f"Request failed with status {status}.")
+
+            async for chunk in read_body(reader, response_headers):
+                yield chunk
+
+            # Without a length or chunked encoding the body ends when the connection closes.
+            reusable = (response_headers.get("connection", "").lower() != "close"
+                        and ("content-length" in response_headers
+                             or response_headers.get("transfer-encoding", "").lower() == "chunked"))
+            return
+
+        finally:
+            if reusable:
+                pool.release(address, reader, writer)
+            else:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except (OSError, ConnectionError):
+                    pass
+
+    raise ConnectionError(f"Too many redirects for '{url}'.")
+
+
+async def request_range_async(url: str, start: int, end: int, pool: AsyncHttpPool) -> AsyncIterator[bytes]:
+    """
+    Downloads the inclusive byte range of the stream url, split into requests of at most RANGE_SIZE bytes.
+    Same as request_range, without blocking the event loop.
+    :param url: The stream url.
+    :param start: First byte to download.
+    :param end: Last byte to download.
+    :param pool: Connections to reuse between the requests.
+    :return: The downloaded chunks in order.
+    """
+    position = start
+    while position <= end:
+        stop_position = min(position + RANGE_SIZE, end + 1) - 1
+        async with aclosing(request_async(f"{url}&range={position}-{stop_position}", pool)) as chunks:
+            async for chunk in chunks:
+                position += len(chunk)
+                yield chunk
+
+        if position <= stop_position:
+            raise ConnectionError(f"Range {position}-{stop_position} ended early.")
+
+
+class AsyncDownloadEngine(DownloadEngine):
+    """
+    Download engine that runs every transfer on one asyncio event loop instead of a thread per download, so
+    hundreds of downloads can run at the same time. Stream lookups, metadata, remuxing and tagging still run on
+    thread pools. Has the same interface and messages as DownloadEngine.
+    Stream remuxing isn't supported, downloads are always processed after they finish.
+    """
+    # Number of threads looking up the streams of videos, which pytube can only do blocking.
+    LOOKUP_WORKERS: Final[int] = 8
+    # Number of threads writing part files and journals, so disk writes don't hold up the event loop.
+    WRITE_WORKERS: Final[int] = 4
+
+    def __init__(self, max_downloads: int = 1, output_queue=None, message_check_frequency: int = 100,
+                 stream_remux: bool = False, max_processes: int = 1, segments: int = 1, config: Mapping = None,
+                 adaptive: bool = False):
+        """
+        :param max_downloads: Number of downloads that can transfer at the same time.
+        :param output_queue: Queue to send progress messages to. A new queue is made if none is provided.
+        :param message_check_frequency: In milliseconds.
+        :param stream_remux: Unsupported, ignored.
+        :param max_processes: Number of downloads that can be processed at the same time.
+        :param segments: Number of byte ranges of each stream to download at the same time.
+        :param config: Configuration snapshot passed to every job. Taken from DataHandler if none is provided.
+        :param adaptive: Unsupported, ignored.
+        """
+        super().__init__(max_downloads, output_queue, message_check_frequency, False, max_processes, segments, config)
+        # The download pool isn't needed, lookups get their own small pool.
+        self.thread_pool.shutdown(wait=False)
+        self.thread_pool = ThreadPoolExecutor(max_workers=self.LOOKUP_WORKERS)
+        self.write_pool = ThreadPoolExecutor(max_workers=self.WRITE_WORKERS)
+        self.http_pool = AsyncHttpPool()
+
+        self.loop = asyncio.new_event_loop()
+        self.download_slots = asyncio.Semaphore(max_downloads)
+        # Same as in DownloadEngine: a download keeps its slot until there is room to hand it off for processing, so
+        # part files can't pile up when processing falls behind.
+        self.handoff_slots = asyncio.BoundedSemaphore(max_processes * 2)
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.loop_thread.start()
+
+    def submit(self, video: YouTube, output_folder: str, audio_only: bool = True, uuid: str = None) -> DownloadJob:
+        """
+        Queues the video for download.
+        :param video: The video to download.
+        :param output_folder: Folder to put the downloaded file in.
+        :param audio_only: True if you want to download the audio only.
+        :param uuid: Identifier to use for the job. A new one is made if none is provided.
+        :return: The queued job.
+        """
+        identifier = uuid if uuid is not None else str(uuid4())
+        args = DownloadRequestArgs(
+            message_check_frequency=self.message_check_frequency,
+            output_queue=self.output_queue,
+            output_folder=output_folder,
+            audio_only=audio_only,
+            stop_event=self.stop_event,
+            uuid=identifier,
+            video=video,
+            config=self.config,
+            segments=self.segments
+        )
+
+        future = asyncio.run_coroutine_threadsafe(self.run_job(args), self.loop)
+        job = DownloadJob(identifier, video, future)
+        self.jobs[identifier] = job
+        return job
+
+    async def run_job(self, args: DownloadRequestArgs):
+        try:
+            async with self.download_slots:
+                fetched = await self.fetch_download(args)
+                if fetched is not None:
+                    await self.handoff_slots.acquire()
+
+            if fetched is not None:
+                try:
+                    await self.loop.run_in_executor(self.process_pool, process_download, args, fetched)
+                finally:
+                    self.handoff_slots.release()
+        except Exception:
+            print(traceback.format_exc())
+        finally:
+            # The claim keeps the folder's index cached, so releasing it doesn't scan.
+            finish_download(args)
+
+    async def fetch_download(self, ars: DownloadRequestArgs) -> FetchedDownload | None:
+        """
+        Downloads the audio stream of the request into a resumable part file.
+        :return: The fetched download, or None if there is nothing left to process.
+        """
+        send_event(ars, "thread started")
+
+        # The first claim in a folder scans its tracks, so it runs off the loop.
+        claimed = await self.loop.run_in_executor(
+            self.write_pool, lambda: LibraryIndex.get(ars.output_folder).claim(ars.video.video_id, ars.uuid))
+        if not claimed:
+            print(f"Skipping '{ars.video.video_id}', it is already in the output folder.")
+            send_event(ars, "skipped")
+            return None
+
+        if not ars.audio_only:
+            send_event(ars, "error")
+            print("Video download is currently unsupported.")
+            return None
+
+        fetched = FetchedDownload(
+            details=metadata_executor.submit(get_track_details, ars.video),
+            extension=".m4a",
+            audio_file=None,
+            video_file=None
+        )
+
+        try:
+            send_event(ars, "finding streams")
+            if ars.stop_event.is_set():
+                send_event(ars, "canceled")
+                return None
+
+            audio_stream = await self.loop.run_in_executor(
+                self.thread_pool, lambda: StreamQuery(ars.video.streams).get_audio_only())
+            if audio_stream is None:
+                raise ValueError(f"No audio stream for '{ars.video.video_id}'.")
+
+            send_event(ars, "started download")
+            fetched = fetched._replace(audio_file=await self.loop.run_in_executor(
+                self.write_pool, PartialDownload.open,
+                ars.video.video_id, audio_stream.itag, audio_stream.filesize, ars.segments))
+            error_code = await self.download_stream(audio_stream, fetched.audio_file, ars)
+            if not handle_stream_error_code(ars, error_code):
+                await self.loop.run_in_executor(self.write_pool, close_fetched_download, fetched, False)
+                return None
+
+            send_event(ars, "completed download")
+            return fetched
+
+        except Exception:
+            print(traceback.format_exc())
+            send_event(ars, "error")
+            await self.loop.run_in_executor(self.write_pool, close_fetched_download, fetched, False)
+            return None
+
+    async def download_stream(self, stream: Stream, partial: PartialDownload,
+                              ars: DownloadRequestArgs) -> DownloadErrorCode:
+        """
+        Downloads the unfinished byte ranges of the partial download at the same time. Same as
+        download_stream_resumable, with the ranges downloaded as tasks instead of threads.
+        :return: The error code.
+        """
+        reporter = ProgressReporter(ars.output_queue, ars.uuid, ars.message_check_frequency)
+        file_size: int = stream.filesize
+        downloaded = partial.bytes_done
+        # Segments of a stream share one turn at the limiter, like the threads of download_stream_resumable.
+        limiter_lock = asyncio.Lock()
+
+        async def download_segment(index: int, start: int, end: int) -> DownloadErrorCode:
+            nonlocal downloaded
+            async with aclosing(request_range_async(stream.url, start, end, self.http_pool)) as chunks:
+                async for chunk in chunks:
+                    if ars.stop_event.is_set():
+                        return DownloadErrorCode.CANCELED
+
+                    async with limiter_lock:
+                        await BandwidthLimiter.consume_async(stream.url, len(chunk), ars.stop_event)
+
+                    await self.loop.run_in_executor(self.write_pool, partial.write, index, chunk)
+                    downloaded += len(chunk)
+                    reporter.report(int(downloaded / file_size * 95))
+
+            return DownloadErrorCode.NONE
+
+        try:
+            if ars.stop_event.is_set():
+                return DownloadErrorCode.CANCELED
+
+            send_event(ars, "started stream")
+            reporter.report(int(downloaded / file_size * 95))
+
+            tasks = [asyncio.create_task(download_segment(*segment)) for segment in partial.remaining_ranges()]
+            try:
+                results = await asyncio.gather(*tasks)
+            except BaseException:
+                # The first failing range cancels the others.
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            if DownloadErrorCode.CANCELED in results:
+                return DownloadErrorCode.CANCELED
+
+            if not await self.loop.run_in_executor(self.write_pool, partial.verify):
+                print(f"Downloaded {partial.bytes_done} bytes, expected {file_size}. Restarting the download next time.")
+                await self.loop.run_in_executor(self.write_pool, partial.delete)
+                return DownloadErrorCode.ERROR
+
+            reporter.flush()
+            send_event(ars, "completed stream")
+            return DownloadErrorCode.NONE
+
+        except Exception:
+            print(traceback.format_exc())
+            return DownloadErrorCode.ERROR
+
+        finally:
+            await self.loop.run_in_executor(self.write_pool, partial.save_journal, True)
+
+    def shutdown(self, wait: bool = True):
+        print("Shutting down event loop.")
+        if wait:
+            for job in list(self.jobs.values()):
+                try:
+                    job.future.result()
+                except Exception:
+                    pass
+        super().shutdown(wait)
+        self.write_pool.shutdown(wait=wait)
+
+        stats = self.http_pool.get_stats()
+        print(f"Sent {stats.requests} async requests on {stats.connections_opened} connections "
+              f"({stats.reuse_rate:.0%} reused).")
+        self.loop.call_soon_threadsafe(self.http_pool.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
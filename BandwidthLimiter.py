@@ -0,0 +1,155 @@
+import asyncio
+import threading
+import time
+from typing import Final
+
+
+class BandwidthLimiter:
+    """
+    Token bucket shared by every download thread that caps the total download rate. Waiting downloads are served
+    by start-time fair queueing: each download's bytes are tagged in order, and the waiting download with the
+    lowest tag goes next. A download reading large chunks then waits for others to catch up, so every download
+    gets an equal share of the bytes whatever its chunk size. The segments of one download share a single place
+    in line, so the share doesn't grow with the number of segments. The rate can be changed at any time.
+    """
+    # Bytes that can be downloaded at once after being idle, in seconds of the rate.
+    BURST_TIME: Final[float] = 0.5
+    # Longest wait before checking the rate again, in seconds.
+    MAX_WAIT: Final[float] = 0.1
+
+    __rate = 0
+    __tokens = 0.0
+    __last_refill = time.monotonic()
+    __condition = threading.Condition()
+    # Key -> tag of the bytes the waiting download is asking for, in the order the downloads started waiting.
+    __waiting: dict[str, float] = {}
+    # Key -> tag after the last bytes paid for by the download. Only kept while it is ahead of the virtual time.
+    __finish_tags: dict[str, float] = {}
+    # Tag of the last bytes paid for. Downloads that were idle start from here instead of claiming the time missed.
+    __virtual_time = 0.0
+
+    # Key -> lock and number of threads using it.
+    __key_locks: dict[str, list] = {}
+    __key_locks_lock = threading.Lock()
+
+    @classmethod
+    def set_rate(cls, rate: int):
+        """
+        Changes the limit. Downloads that are waiting use the new rate right away.
+        :param rate: Bytes per second. (0 = unlimited)
+        """
+        with cls.__condition:
+            cls.refill()
+            cls.__rate = max(0, rate)
+            cls.__tokens = min(cls.__tokens, cls.__rate * cls.BURST_TIME)
+            cls.__condition.notify_all()
+        print(f"Bandwidth limit set to {'unlimited' if rate <= 0 else f'{rate // 1024} KiB/s'}.")
+
+    @classmethod
+    def get_rate(cls) -> int:
+        return cls.__rate
+
+    @classmethod
+    def refill(cls):
+        """Adds the tokens earned since the last refill. Must be called with the condition held."""
+        now = time.monotonic()
+        cls.__tokens = min(cls.__tokens + (now - cls.__last_refill) * cls.__rate, cls.__rate * cls.BURST_TIME)
+        cls.__last_refill = now
+
+    @classmethod
+    def consume(cls, key: str, byte_count: int, stop_event: threading.Event = None):
+        """
+        Pays for downloaded bytes, waiting until the rate allows them. Bytes can be paid for before there are
+        enough tokens, the debt then holds up the next downloads instead.
+        :param key: Identifies the download. Threads using the same key share a turn.
+        :param byte_count: Number of bytes downloaded.
+        :param stop_event: Returns within MAX_WAIT without paying once set.
+        """
+        if cls.__rate <= 0:
+            return
+
+        key_lock = cls.acquire_key_lock(key)
+        try:
+            with key_lock, cls.__condition:
+                try:
+                    while cls.__rate > 0 and (stop_event is None or not stop_event.is_set()):
+                        wait_time = cls.try_consume(key, byte_count)
+                        if wait_time <= 0:
+                            break
+                        cls.__condition.wait(max(wait_time, 0.001))
+                finally:
+                    cls.cancel(key)
+        finally:
+            cls.release_key_lock(key)
+
+    @classmethod
+    async def consume_async(cls, key: str, byte_count: int, stop_event: threading.Event = None):
+        """
+        Same as consume, for coroutines on an event loop. The wait is an asyncio sleep, so no thread is held.
+        Only one coroutine per key may wait at a time.
+        :param key: Identifies the download.
+        :param byte_count: Number of bytes downloaded.
+        :param stop_event: Returns within MAX_WAIT without paying once set.
+        """
+        try:
+            while stop_event is None or not stop_event.is_set():
+                with cls.__condition:
+                    if cls.__rate <= 0:
+                        return
+                    wait_time = cls.try_consume(key, byte_count)
+                if wait_time <= 0:
+                    return
+                await asyncio.sleep(max(wait_time, 0.001))
+        finally:
+            with cls.__condition:
+                cls.cancel(key)
+
+    @classmethod
+    def try_consume(cls, key: str, byte_count: int) -> float:
+        """
+        Pays for the bytes if it is the download's turn and there are tokens, otherwise puts it in line.
+        Must be called with the condition held.
+        :param key: Identifies the download. Only one caller per key may be waiting.
+        :param byte_count: Number of bytes downloaded.
+        :return: 0 if the bytes were paid for, otherwise the time to wait before trying again in seconds.
+        """
+        cls.refill()
+        if key not in cls.__waiting:
+            cls.__waiting[key] = max(cls.__finish_tags.get(key, 0.0), cls.__virtual_time)
+
+        start_tag = cls.__waiting[key]
+        first_key = min(cls.__waiting, key=cls.__waiting.__getitem__)
+        if first_key != key:
+            return cls.MAX_WAIT
+        if cls.__tokens <= 0:
+            return min(cls.MAX_WAIT, -cls.__tokens / cls.__rate)
+
+        cls.__tokens -= byte_count
+        del cls.__waiting[key]
+        cls.__virtual_time = start_tag
+        cls.__finish_tags[key] = start_tag + byte_count
+        for other_key in [other_key for other_key, tag in cls.__finish_tags.items() if tag <= cls.__virtual_time]:
+            del cls.__finish_tags[other_key]
+        cls.__condition.notify_all()
+        return 0.0
+
+    @classmethod
+    def cancel(cls, key: str):
+        """Takes the download out of line if it is waiting. Must be called with the condition held."""
+        if cls.__waiting.pop(key, None) is not None:
+            cls.__condition.notify_all()
+
+    @classmethod
+    def acquire_key_lock(cls, key: str) -> threading.Lock:
+        with cls.__key_locks_lock:
+            entry = cls.__key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+            return entry[0]
+
+    @classmethod
+    def release_key_lock(cls, key: str):
+        with cls.__key_locks_lock:
+            entry = cls.__key_locks[key]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del cls.__key_locks[key]
@@ -0,0 +1,131 @@
+import threading
+import time
+from typing import Final
+
+
+class ConcurrencyController:
+    """
+    Tunes how many downloads run at the same time from the measured total throughput (AIMD). One more download is
+    allowed while adding downloads keeps raising the throughput. The limit is halved as soon as YouTube starts
+    throttling (HTTP 403 or 429), and lowered by one when more than MAX_FAILURE_RATE of the requests fail.
+    Downloads report their requests, bytes and failures through the class methods, which every controller reads.
+    """
+    MIN_LIMIT: Final[int] = 1
+    MAX_LIMIT: Final[int] = 16
+    # Time between adjustments, in seconds.
+    INTERVAL: Final[float] = 3.0
+    # Smallest relative throughput change that counts as better or worse.
+    THRESHOLD: Final[float] = 0.05
+    THROTTLE_STATUS_CODES: Final[tuple[int, ...]] = (403, 429)
+    # Share of the requests in an interval that may fail before the limit is lowered.
+    MAX_FAILURE_RATE: Final[float] = 0.1
+
+    __requests = 0
+    __bytes = 0
+    __failures = 0
+    __throttles = 0
+    __counters_lock = threading.Lock()
+
+    def __init__(self, initial_limit: int, stop_event: threading.Event):
+        """
+        :param initial_limit: Number of downloads allowed at first.
+        :param stop_event: Waiting downloads are let through once it is set, so they can cancel.
+        """
+        self.limit = max(self.MIN_LIMIT, min(self.MAX_LIMIT, initial_limit))
+        self.active = 0
+        self.stop_event = stop_event
+        self.condition = threading.Condition()
+        self.closed = threading.Event()
+
+        self.last_rate = 0.0
+        self.last_increased = False
+        self.last_counters = self.get_counters()
+        self.last_time = time.monotonic()
+        self.monitor_thread = threading.Thread(target=self.monitor, daemon=True)
+        self.monitor_thread.start()
+
+    @classmethod
+    def record_request(cls):
+        with cls.__counters_lock:
+            cls.__requests += 1
+
+    @classmethod
+    def record_bytes(cls, byte_count: int):
+        with cls.__counters_lock:
+            cls.__bytes += byte_count
+
+    @classmethod
+    def record_failure(cls, status_code: int = None):
+        """Records a failed request. Throttling status codes count as throttles."""
+        with cls.__counters_lock:
+            if status_code in cls.THROTTLE_STATUS_CODES:
+                cls.__throttles += 1
+            else:
+                cls.__failures += 1
+
+    @classmethod
+    def get_counters(cls) -> tuple[int, int, int, int]:
+        with cls.__counters_lock:
+            return cls.__requests, cls.__bytes, cls.__failures, cls.__throttles
+
+    def acquire(self):
+        """Waits until another download is allowed to run."""
+        with self.condition:
+            while self.active >= self.limit and not self.stop_event.is_set():
+                self.condition.wait(0.5)
+            self.active += 1
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def monitor(self):
+        while not self.closed.wait(self.INTERVAL):
+            self.adjust()
+
+    def adjust(self):
+        """Changes the limit from the throughput and failures since the last adjustment."""
+        now = time.monotonic()
+        counters = self.get_counters()
+        requests, byte_count, failures, throttles = (new - old for new, old in zip(counters, self.last_counters))
+        rate = byte_count / max(now - self.last_time, 0.001)
+        self.last_counters = counters
+        self.last_time = now
+
+        with self.condition:
+            # A range request can outlast the interval, so every running download counts as at least one request.
+            failure_rate = failures / max(requests, self.active, 1)
+            limit = self.limit
+            if throttles > 0:
+                # Multiplicative decrease.
+                limit = max(self.MIN_LIMIT, limit // 2)
+                self.last_increased = False
+            elif failure_rate > self.MAX_FAILURE_RATE:
+                # Occasional failures are retried or resumed, only a high error rate means too many downloads.
+                limit = max(self.MIN_LIMIT, limit - 1)
+                self.last_increased = False
+            elif self.active < self.limit:
+                # Not every slot is in use, so the throughput says nothing about the limit.
+                pass
+            elif rate >= self.last_rate * (1 + self.THRESHOLD):
+                # Additive increase while more downloads keep helping.
+                limit = min(self.MAX_LIMIT, limit + 1)
+                self.last_increased = limit != self.limit
+            elif self.last_increased and rate < self.last_rate * (1 - self.THRESHOLD):
+                # The last download added made things worse.
+                limit = max(self.MIN_LIMIT, limit - 1)
+                self.last_increased = False
+
+            if limit != self.limit:
+                print(f"Simultaneous downloads {self.limit} -> {limit} at {rate / 1048576:.1f} MiB/s "
+                      f"({failures}/{requests} requests failed, {throttles} throttled).")
+                self.limit = limit
+                self.condition.notify_all()
+
+        self.last_rate = rate
+
+    def close(self):
+        self.closed.set()
+        with self.condition:
+            self.condition.notify_all()
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Final
+
+from AppDataHandler import DataHandler
+from HttpPool import HttpPool
+
+
+class CoverArtCache:
+    """
+    Cache for cover art. Recently used covers are kept in memory and every cover is saved in the cache folder,
+    named by the hash of its content so a cover shared by many urls is only stored once.
+    """
+    folder_name = "covers"
+    cache_key_prefix = "cover:"
+
+    MEMORY_LIMIT: Final[int] = 33554432
+    DISK_LIMIT: Final[int] = 268435456
+    # How long a url is trusted to point at the same cover, in seconds.
+    TIME_TO_LIVE: Final[int] = 604800
+    REQUEST_TIMEOUT: Final[int] = 15
+
+    __memory: OrderedDict[str, bytes] = OrderedDict()
+    __memory_size = 0
+    __memory_lock = threading.Lock()
+    __url_locks: dict[str, threading.Lock] = {}
+
+    @classmethod
+    def get_folder(cls) -> str:
+        return os.path.join(DataHandler.get_cache_dir(), cls.folder_name)
+
+    @classmethod
+    def get(cls, url: str) -> bytes:
+        """
+        Gets the cover at the url, downloading it only if it isn't cached.
+        :param url: The cover url.
+        :return: The image data.
+        """
+        cover = cls.get_from_memory(url)
+        if cover is not None:
+            return cover
+
+        # Only one thread fetches a url, the others wait for it.
+        with cls.__memory_lock:
+            url_lock = cls.__url_locks.setdefault(url, threading.Lock())
+
+        with url_lock:
+            cover = cls.get_from_memory(url)
+            if cover is None:
+                cover = cls.get_from_disk(url)
+            if cover is None:
+                cover = cls.download(url)
+            cls.add_to_memory(url, cover)
+            return cover
+
+    @classmethod
+    def get_from_memory(cls, url: str) -> bytes | None:
+        with cls.__memory_lock:
+            if url not in cls.__memory:
+                return None
+            cls.__memory.move_to_end(url)
+            return cls.__memory[url]
+
+    @classmethod
+    def add_to_memory(cls, url: str, cover: bytes):
+        with cls.__memory_lock:
+            if url in cls.__memory:
+                return
+
+            cls.__memory[url] = cover
+            cls.__memory_size += len(cover)
+            while cls.__memory_size > cls.MEMORY_LIMIT and len(cls.__memory) > 1:
+                _, evicted = cls.__memory.popitem(last=False)
+                cls.__memory_size -= len(evicted)
+
+    @classmethod
+    def get_from_disk(cls, url: str) -> bytes | None:
+        entry = DataHandler.retrieve_cache_file_info(cls.cache_key_prefix + url)
+        if entry is None or time.time() - entry["time"] > cls.TIME_TO_LIVE:
+            return None
+
+        path = os.path.join(cls.get_folder(), entry["hash"])
+        try:
+            with open(path, "rb") as file:
+                cover = file.read()
+            # Recently used covers are evicted last.
+            os.utime(path)
+            return cover
+        except OSError:
+            return None
+
+    @classmethod
+    def download(cls, url: str) -> bytes:
+        print(f"Downloading cover '{url}'.")
+        with HttpPool.open(url, timeout=cls.REQUEST_TIMEOUT) as http_req:
+            cover = http_req.read()
+
+        content_hash = hashlib.sha256(cover).hexdigest()
+        folder = cls.get_folder()
+        path = os.path.join(folder, content_hash)
+        try:
+            os.makedirs(folder, exist_ok=True)
+            if not os.path.exists(path):
+                temp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(temp_path, "wb") as file:
+                    file.write(cover)
+                os.replace(temp_path, path)
+                cls.evict_from_disk()
+
+            DataHandler.update_cache_file(cls.cache_key_prefix + url, {"hash": content_hash, "time": time.time()})
+        except (OSError, sqlite3.Error):
+            print(f"Unable to cache cover '{url}'.")
+
+        return cover
+
+    @classmethod
+    def evict_from_disk(cls):
+        """Deletes the least recently used covers until the folder fits in DISK_LIMIT."""
+        entries = [entry for entry in os.scandir(cls.get_folder()) if entry.is_file()]
+        total_size = sum(entry.stat().st_size for entry in entries)
+        if total_size <= cls.DISK_LIMIT:
+            return
+
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if total_size <= cls.DISK_LIMIT:
+                break
+            total_size -= entry.stat().st_size
+            os.remove(entry.path)
@@ -1,7 +1,8 @@
 import typing
 
+from PyQt6.QtCore import QAbstractListModel, QModelIndex, Qt, QSize, QRect
 from PyQt6.QtWidgets import QLabel, QVBoxLayout, QHBoxLayout, QSpinBox, QWidget, QDialog, QDialogButtonBox, QCheckBox, \
-    QProgressBar
+    QStyledItemDelegate, QStyleOptionViewItem, QStyleOptionProgressBar, QStyle, QApplication
 
 
 class LabeledSpinbox(QWidget):
@@ -82,29 +83,190 @@ class LabeledCheckbox(QWidget):
         return self.check_box.isChecked()
 
 
-class DownloadListItem(QWidget):
-    def __init__(self, text: str):
-        super().__init__()
+class DownloadRow(typing.NamedTuple):
+    """
+    Attributes
+    ----------
+    text : str
+        Number and title of the download.
+    status : str
+        Current status of the download.
+    progress : int
+        Download progress from 0 to 100.
+    """
+    text: str
+    status: str = "Waiting..."
+    progress: int = 0
 
-        self.label = QLabel(text)
-        self.label.setFixedHeight(16)
-        self.progress_bar = QProgressBar()
-        self.progress_bar.setFixedHeight(16)
-        self.statusLabel = QLabel("Waiting...")
-        self.statusLabel.setFixedHeight(16)
-
-        header = QHBoxLayout()
-        header.addWidget(self.label)
-        header.addWidget(self.statusLabel)
-        layout = QVBoxLayout()
-        layout.addLayout(header)
-        layout.addWidget(self.progress_bar)
-        self.setLayout(layout)
-        self.setFixedHeight(32)
-        print(f"Created list item {text}")
 
-    def update_progress(self, progress: int):
-        self.progress_bar.setValue(progress)
+class DownloadListModel(QAbstractListModel):
+    """
+    Rows of a download list. Updates are collected and applied to the view with flush, so a batch of messages
+    repaints each changed row once.
+    """
+    StatusRole = Qt.ItemDataRole.UserRole
+    ProgressRole = Qt.ItemDataRole.UserRole + 1
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows: list[DownloadRow] = []
+        self.uuid_row_map: dict[str, int] = {}
+        self.changed_rows: set[int] = set()
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+
+        row = self.rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return row.text
+        elif role == self.StatusRole:
+            return row.status
+        elif role == self.ProgressRole:
+            return row.progress
+        return None
+
+    def clear(self):
+        self.beginResetModel()
+        self.rows = []
+        self.uuid_row_map = {}
+        self.changed_rows.clear()
+        self.endResetModel()
+
+    def add_rows(self, rows: list[tuple[str, str]]):
+        """
+        Appends rows to the end of the list.
+        :param rows: (uuid, text) for each new download.
+        """
+        if len(rows) == 0:
+            return
+
+        first = len(self.rows)
+        self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+        for uuid, text in rows:
+            self.uuid_row_map[uuid] = len(self.rows)
+            self.rows.append(DownloadRow(text))
+        self.endInsertRows()
+
+    def update_status(self, uuid: str, status: str):
+        self.update_row(uuid, status=status)
+
+    def update_progress(self, uuid: str, progress: int):
+        self.update_row(uuid, progress=progress)
+
+    def update_row(self, uuid: str, **changes):
+        """Changes the row of the download. The view is not updated until flush is called."""
+        index = self.uuid_row_map[uuid]
+        self.rows[index] = self.rows[index]._replace(**changes)
+        self.changed_rows.add(index)
+
+    def flush(self):
+        """Tells the view about every row changed since the last flush with a single signal."""
+        if len(self.changed_rows) == 0:
+            return
+
+        first = self.index(min(self.changed_rows))
+        last = self.index(max(self.changed_rows))
+        self.changed_rows.clear()
+        self.dataChanged.emit(first, last, [self.StatusRole, self.ProgressRole])
+
+
+class StreamRow(typing.NamedTuple):
+    """
+    Attributes
+    ----------
+    video_id : int
+        Position of the video in the link, starting at 1.
+    video : typing.Any
+        The video to download.
+    title : str
+        Title of the video.
+    author : str
+        Uploader of the video.
+    """
+    video_id: int
+    video: typing.Any
+    title: str
+    author: str
+
+
+class StreamListModel(QAbstractListModel):
+    """Videos that can be selected for download. The video id of a row is its UserRole data."""
+    VideoIdRole = Qt.ItemDataRole.UserRole
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows: list[StreamRow] = []
+        self.id_row_map: dict[int, int] = {}
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+
+        row = self.rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return f"{row.video_id}. {row.title} - {row.author}"
+        elif role == self.VideoIdRole:
+            return row.video_id
+        return None
+
+    def clear(self):
+        self.beginResetModel()
+        self.rows = []
+        self.id_row_map = {}
+        self.endResetModel()
+
+    def add_rows(self, rows: list[StreamRow]):
+        """Appends rows to the end of the list with a single insert."""
+        if len(rows) == 0:
+            return
+
+        first = len(self.rows)
+        self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+        for row in rows:
+            self.id_row_map[row.video_id] = len(self.rows)
+            self.rows.append(row)
+        self.endInsertRows()
+
+    def get_row(self, video_id: int) -> StreamRow:
+        return self.rows[self.id_row_map[video_id]]
+
+
+class DownloadListDelegate(QStyledItemDelegate):
+    """Paints a download row with its title, status and progress bar without creating any widgets."""
+    ROW_HEIGHT = 36
+    TEXT_HEIGHT = 16
+    MARGIN = 2
+
+    def sizeHint(self, option: QStyleOptionViewItem, index: QModelIndex) -> QSize:
+        return QSize(option.rect.width(), self.ROW_HEIGHT)
+
+    def paint(self, painter, option: QStyleOptionViewItem, index: QModelIndex):
+        style = option.widget.style() if option.widget is not None else QApplication.style()
+        rect = option.rect.adjusted(self.MARGIN, self.MARGIN, -self.MARGIN, -self.MARGIN)
+        text_rect = QRect(rect.left(), rect.top(), rect.width(), self.TEXT_HEIGHT)
+
+        painter.save()
+        painter.setPen(option.palette.color(option.palette.ColorRole.Text))
+        status = index.data(DownloadListModel.StatusRole)
+        status_width = option.fontMetrics.horizontalAdvance(status) + self.MARGIN
+        painter.drawText(text_rect.adjusted(0, 0, -status_width, 0),
+                         Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter,
+                         option.fontMetrics.elidedText(index.data(), Qt.TextElideMode.ElideRight,
+                                                       text_rect.width() - status_width))
+        painter.drawText(text_rect, Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter, status)
+        painter.restore()
 
-    def update_status(self, status: str):
-        self.statusLabel.setText(status)
\ No newline at end of file
+        progress_option = QStyleOptionProgressBar()
+        progress_option.rect = QRect(rect.left(), text_rect.bottom() + 1, rect.width(), rect.bottom() - text_rect.bottom())
+        progress_option.minimum = 0
+        progress_option.maximum = 100
+        progress_option.progress = index.data(DownloadListModel.ProgressRole)
+        progress_option.state = QStyle.StateFlag.State_Enabled
+        style.drawControl(QStyle.ControlElement.CE_ProgressBar, progress_option, painter, option.widget)
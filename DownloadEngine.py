@@ -0,0 +1,231 @@
+import queue
+import threading
+import traceback
+from concurrent.futures import Future
+from concurrent.futures.thread import ThreadPoolExecutor
+from typing import NamedTuple, Iterator, Mapping, Iterable
+from uuid import uuid4
+
+from pytube import YouTube
+
+from AppDataHandler import DataHandler
+from BandwidthLimiter import BandwidthLimiter
+from ConcurrencyController import ConcurrencyController
+from DownloadHelpers import download_with_progress, DownloadRequestArgs, DownloadProgressMessage, fetch_download, \
+    process_download, finish_download, FetchedDownload
+from HttpPool import HttpPool
+from LibraryIndex import LibraryIndex
+from LinkResolver import VideoEntry
+from PartialDownloads import PartialDownload
+
+
+class DownloadJob(NamedTuple):
+    """
+    Attributes
+    ----------
+    uuid : str
+        Identifier for the download request.
+    video : YouTube
+        The video being downloaded.
+    future : Future
+        Resolves once the download has been downloaded and processed.
+    """
+    uuid: str
+    video: YouTube
+    future: Future
+
+
+class DownloadEngine:
+    """
+    Runs download requests without depending on a GUI.
+    Streams are downloaded on one thread pool and handed off to a second pool that remuxes and tags them,
+    so slow processing never holds up a network slot. Progress is reported through DownloadProgressMessages
+    put on the output queue.
+    """
+
+    def __init__(self, max_downloads: int = 1, output_queue=None, message_check_frequency: int = 100,
+                 stream_remux: bool = False, max_processes: int = 1, segments: int = 1, config: Mapping = None,
+                 adaptive: bool = False):
+        """
+        :param max_downloads: Number of downloads that can run at the same time. The starting number when adaptive.
+        :param output_queue: Queue to send progress messages to. A new queue is made if none is provided.
+        :param message_check_frequency: In milliseconds.
+        :param stream_remux: True to remux audio while it downloads. Both stages then run on the download pool.
+        :param max_processes: Number of downloads that can be processed at the same time.
+        :param segments: Number of byte ranges of each stream to download at the same time.
+        :param config: Configuration snapshot passed to every job. Taken from DataHandler if none is provided.
+        :param adaptive: True to tune the number of simultaneous downloads from the measured throughput.
+        """
+        self.output_queue = output_queue if output_queue is not None else queue.Queue()
+        self.message_check_frequency = message_check_frequency
+        self.stream_remux = stream_remux
+        self.segments = segments
+        self.config = config if config is not None else DataHandler.get_config_snapshot()
+        BandwidthLimiter.set_rate(self.config[DataHandler.bandwidth_limit_key] * 1024)
+        PartialDownload.cleanup()
+        LibraryIndex.invalidate()
+        self.stop_event = threading.Event()
+
+        # When adaptive, the pool has a thread for the most downloads allowed and the controller decides how many run.
+        self.controller = ConcurrencyController(max_downloads, self.stop_event) if adaptive else None
+        self.thread_pool = ThreadPoolExecutor(
+            max_workers=ConcurrencyController.MAX_LIMIT if adaptive else max_downloads)
+        self.process_pool = ThreadPoolExecutor(max_workers=max_processes)
+
+        # Fetched downloads keep their part files until processed, so only a bounded number may be
+        # waiting for or in processing. Download threads block here when processing falls behind.
+        self.handoff_slots = threading.BoundedSemaphore(max_processes * 2)
+        self.jobs: dict[str, DownloadJob] = {}
+        self.finished_jobs: set[str] = set()
+        # Set while submit_as_discovered is still adding jobs.
+        self.discovering = threading.Event()
+
+    def submit(self, video: YouTube, output_folder: str, audio_only: bool = True, uuid: str = None) -> DownloadJob:
+        """
+        Queues the video for download.
+        :param video: The video to download.
+        :param output_folder: Folder to put the downloaded file in.
+        :param audio_only: True if you want to download the audio only.
+        :param uuid: Identifier to use for the job. A new one is made if none is provided.
+        :return: The queued job.
+        """
+        identifier = uuid if uuid is not None else str(uuid4())
+        args = DownloadRequestArgs(
+            message_check_frequency=self.message_check_frequency,
+            output_queue=self.output_queue,
+            output_folder=output_folder,
+            audio_only=audio_only,
+            stop_event=self.stop_event,
+            uuid=identifier,
+            video=video,
+            config=self.config,
+            stream_remux=self.stream_remux,
+            segments=self.segments
+        )
+
+        job = DownloadJob(identifier, video, Future())
+        self.jobs[identifier] = job
+        if self.stream_remux and audio_only:
+            self.thread_pool.submit(self.run_single_stage_job, args, job.future)
+        else:
+            self.thread_pool.submit(self.run_download_stage, args, job.future)
+        return job
+
+    def submit_as_discovered(self, entries: Iterable[VideoEntry], output_folder: str, audio_only: bool = True,
+                             limit: int = 0) -> threading.Thread:
+        """
+        Queues each video as soon as the entries produce it, so downloads start while a playlist is still being
+        listed. A "discovered" message with the video number and title is sent before each job's other messages,
+        and a "discovery finished" event once there are no more videos.
+        :param entries: The videos to download, usually a generator.
+        :param output_folder: Folder to put the downloaded files in.
+        :param audio_only: True if you want to download the audio only.
+        :param limit: Maximum number of videos to queue. (0 = unlimited)
+        :return: The thread consuming the entries.
+        """
+        self.discovering.set()
+
+        def discover():
+            try:
+                for number, entry in enumerate(entries, start=1):
+                    if self.stop_event.is_set():
+                        break
+
+                    identifier = str(uuid4())
+                    self.output_queue.put(DownloadProgressMessage(
+                        type="discovered",
+                        value=f"{number}. {entry.title or entry.url}",
+                        uuid=identifier
+                    ))
+                    self.submit(entry.to_youtube(), output_folder, audio_only, identifier)
+
+                    if 0 < limit <= number:
+                        break
+
+            except Exception:
+                print(traceback.format_exc())
+
+            finally:
+                self.discovering.clear()
+                self.output_queue.put(DownloadProgressMessage(
+                    type="event",
+                    value="discovery finished",
+                    uuid=""
+                ))
+
+        thread = threading.Thread(target=discover, daemon=True)
+        thread.start()
+        return thread
+
+    def run_single_stage_job(self, args: DownloadRequestArgs, future: Future):
+        try:
+            self.acquire_download_slot()
+            try:
+                download_with_progress(args)
+            finally:
+                self.release_download_slot()
+        finally:
+            future.set_result(None)
+
+    def run_download_stage(self, args: DownloadRequestArgs, future: Future):
+        fetched = None
+        try:
+            self.acquire_download_slot()
+            try:
+                fetched = fetch_download(args)
+            finally:
+                self.release_download_slot()
+            if fetched is not None:
+                self.handoff_slots.acquire()
+                self.process_pool.submit(self.run_process_stage, args, fetched, future)
+        finally:
+            if fetched is None:
+                finish_download(args)
+                future.set_result(None)
+
+    def run_process_stage(self, args: DownloadRequestArgs, fetched: FetchedDownload, future: Future):
+        try:
+            process_download(args, fetched)
+        finally:
+            self.handoff_slots.release()
+            finish_download(args)
+            future.set_result(None)
+
+    def acquire_download_slot(self):
+        if self.controller is not None:
+            self.controller.acquire()
+
+    def release_download_slot(self):
+        if self.controller is not None:
+            self.controller.release()
+
+    def stop(self):
+        """Requests every queued and running download to stop."""
+        print("Stopping downloads.")
+        self.stop_event.set()
+
+    def shutdown(self, wait: bool = True):
+        print("Shutting down thread pools.")
+        self.thread_pool.shutdown(wait=wait)
+        self.process_pool.shutdown(wait=wait)
+        if self.controller is not None:
+            self.controller.close()
+
+        stats = HttpPool.get_stats()
+        print(f"Sent {stats.requests} requests on {stats.connections_opened} connections "
+              f"({stats.reuse_rate:.0%} reused).")
+
+    def messages(self) -> Iterator[DownloadProgressMessage]:
+        """
+        Yields progress messages until every submitted job has finished and no more jobs are being discovered.
+        Only usable when the engine owns a blocking queue.
+        """
+        while self.discovering.is_set() or len(self.finished_jobs) < len(self.jobs):
+            try:
+                message: DownloadProgressMessage = self.output_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            if message.type == "event" and message.value == "thread finished":
+                self.finished_jobs.add(message.uuid)
+            yield message
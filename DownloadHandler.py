@@ -1,18 +1,19 @@
-import queue
 import threading
-from concurrent.futures.thread import ThreadPoolExecutor
-from typing import NamedTuple, List
-from uuid import uuid4
+from typing import NamedTuple, List, Iterator, TYPE_CHECKING
 
-from PyQt6.QtCore import QTimer
-from PyQt6.QtWidgets import QWidget, QHBoxLayout, QLabel, QPushButton, QVBoxLayout, QScrollArea, QFormLayout
-from pytube import YouTube
+from PyQt6.QtWidgets import QWidget, QHBoxLayout, QLabel, QPushButton, QVBoxLayout, QListView
 
-import yt_dlp.YoutubeDL
-import DownloadHelpers
 from AppDataHandler import DataHandler
-from CustomWidgets import DownloadListItem
-from DownloadHelpers import download_with_progress, DownloadRequestArgs
+from BandwidthLimiter import BandwidthLimiter
+from CustomWidgets import DownloadListModel, DownloadListDelegate, LabeledSpinbox
+from LinkResolver import VideoEntry
+from MessageBridge import MessageBridge
+
+# The download engine pulls in pytube, ffmpeg and mutagen, so it is imported when the first batch starts.
+if TYPE_CHECKING:
+    from pytube import YouTube
+    from DownloadEngine import DownloadEngine
+    from DownloadHelpers import DownloadProgressMessage
 
 
 class DownloadRequest_YTDLP(NamedTuple):
@@ -21,9 +22,10 @@ class DownloadRequest_YTDLP(NamedTuple):
 
 class DownloadRequest(NamedTuple):
     video_number: int
-    video: YouTube
+    video: 'YouTube'
     audio_only: bool
     output_path: str
+    title: str
 
 
 class DownloadViewer(QWidget):
@@ -31,16 +33,14 @@ class DownloadViewer(QWidget):
         super(DownloadViewer, self).__init__()
 
         print("Init download viewer.")
-        self.output_queue = queue.Queue()
-        self.stop_download_event = threading.Event()
+        self.output_queue = MessageBridge(self)
+        self.output_queue.messages_received.connect(self.on_messages_received)
         self.pause_download_event = threading.Event()
-        self.message_check_timer = QTimer(self)
-        self.message_check_timer.timeout.connect(self.check_for_messages)
         self.threads_finished = 0
         self.total_threads_to_finish = 0
-        self.thread_pool: ThreadPoolExecutor = None
+        self.engine: 'DownloadEngine' = None
+        self.discovering = False
         self.go_back_callback = []
-        self.uuid_list_item_map: dict[str, DownloadListItem] = {}
 
         # Top Bar
         top_bar = QHBoxLayout()
@@ -48,12 +48,24 @@ class DownloadViewer(QWidget):
         self.return_button.pressed.connect(self.on_go_back_pressed)
         self.stop_button = QPushButton("Stop")
         self.stop_button.pressed.connect(self.on_stop_pressed)
+        # Applied to running downloads as soon as it changes.
+        self.bandwidth_limit = LabeledSpinbox("Limit KiB/s\n(0 = unlimited)", 0)
+        self.bandwidth_limit.set_value(DataHandler.get_config_file_info()[DataHandler.bandwidth_limit_key])
+        self.bandwidth_limit.spin_box.valueChanged.connect(self.on_bandwidth_limit_changed)
+        self.bandwidth_limit.spin_box.editingFinished.connect(lambda: DataHandler.update_config_file(
+            DataHandler.bandwidth_limit_key, self.bandwidth_limit.get_value()))
         top_bar.addWidget(QLabel("Downloads"))
+        top_bar.addWidget(self.bandwidth_limit)
         top_bar.addWidget(self.stop_button)
         top_bar.addWidget(self.return_button)
 
-        self.download_list_view = QScrollArea()
-        self.download_list_view.setWidgetResizable(True)
+        # Only the visible rows are painted, so the list stays fast however many downloads there are.
+        self.download_list_model = DownloadListModel(self)
+        self.download_list_view = QListView()
+        self.download_list_view.setModel(self.download_list_model)
+        self.download_list_view.setItemDelegate(DownloadListDelegate(self.download_list_view))
+        self.download_list_view.setUniformItemSizes(True)
+        self.download_list_view.setSelectionMode(QListView.SelectionMode.NoSelection)
 
         layout = QVBoxLayout()
         layout.addLayout(top_bar)
@@ -62,9 +74,13 @@ class DownloadViewer(QWidget):
 
     def on_stop_pressed(self):
         print("Stopping downloads.")
-        self.stop_download_event.set()
+        if self.engine is not None:
+            self.engine.stop()
         self.stop_button.setDisabled(True)
 
+    def on_bandwidth_limit_changed(self, value: int):
+        BandwidthLimiter.set_rate(value * 1024)
+
     def on_go_back_pressed(self):
         print("Going back.")
         for callback in self.go_back_callback:
@@ -73,85 +89,119 @@ class DownloadViewer(QWidget):
     def register_go_back_callback(self, callback):
         self.go_back_callback.append(callback)
 
-    def set_download_list(self, download_list: List[DownloadRequest]):
-        print(f"Setting download list: {len(download_list)} items.")
+    def start_batch(self, total_threads_to_finish: int) -> tuple['DownloadEngine', bool]:
+        """Resets the view and creates the engine for a new batch of downloads."""
         self.return_button.setDisabled(True)
         self.stop_button.setDisabled(False)
 
         self.pause_download_event.clear()
-        self.stop_download_event.clear()
-        self.message_check_timer.start(100)
+        self.output_queue.clear()
         self.threads_finished = 0
-        self.total_threads_to_finish = len(download_list)
+        self.total_threads_to_finish = total_threads_to_finish
+        self.discovering = False
+        self.download_list_model.clear()
         print(f"Total threads to complete: {self.total_threads_to_finish}")
 
-        thread_count = DataHandler.get_config_file_info()[DataHandler.sim_download_key]
-        audio_only = DataHandler.get_config_file_info()[DataHandler.audio_only_key]
-        print(f"Using {thread_count} threads.\nAudio Only: {audio_only}")
+        config = DataHandler.get_config_snapshot({DataHandler.bandwidth_limit_key: self.bandwidth_limit.get_value()})
+        thread_count = config[DataHandler.sim_download_key]
+        process_count = config[DataHandler.sim_process_key]
+        audio_only = config[DataHandler.audio_only_key]
+        stream_remux = config[DataHandler.stream_remux_key]
+        segments = config[DataHandler.download_segments_key]
+        async_downloads = config[DataHandler.async_downloads_key]
+        adaptive = config[DataHandler.adaptive_downloads_key]
+        print(f"Using {thread_count} download threads and {process_count} processing threads.\nAudio Only: {audio_only}\nStream Remux: {stream_remux}\nAsync Downloads: {async_downloads}\nAuto Tune: {adaptive}")
+
+        if async_downloads:
+            from AsyncDownloadEngine import AsyncDownloadEngine
+            engine_type = AsyncDownloadEngine
+        else:
+            from DownloadEngine import DownloadEngine
+            engine_type = DownloadEngine
+
+        self.engine = engine_type(thread_count, self.output_queue, stream_remux=stream_remux,
+                                  max_processes=process_count, segments=segments, config=config,
+                                  adaptive=adaptive)
+
+        return self.engine, audio_only
+
+    def set_download_list(self, download_list: List[DownloadRequest]):
+        print(f"Setting download list: {len(download_list)} items.")
+        engine, _ = self.start_batch(len(download_list))
 
-        progress_bar_list = []
-        self.thread_pool = ThreadPoolExecutor(max_workers=thread_count)
+        rows = []
         for request in download_list:
-            identifier = str(uuid4())
-            item = DownloadListItem(f"{request.video_number}. {request.video.title}")
-            self.uuid_list_item_map[identifier] = item
-            progress_bar_list.append(item)
-
-            args = DownloadRequestArgs(
-                message_check_frequency=100,
-                output_queue=self.output_queue,
-                output_folder=request.output_path,
-                audio_only=request.audio_only,
-                stop_event=self.stop_download_event,
-                uuid=identifier,
-                video=request.video
-            )
-            self.thread_pool.submit(download_with_progress, args)
-
-        scroll_layout = QFormLayout()
-        scroll_layout.setVerticalSpacing(0)
-        for item in progress_bar_list:
-            scroll_layout.addRow(item)
-
-        container = QWidget()
-        container.setLayout(scroll_layout)
-        self.download_list_view.setWidget(container)
-
-    def check_for_messages(self):
-        while not self.output_queue.empty():
-            self.on_progress_message_received(self.output_queue.get())
-
-    def on_progress_message_received(self, message: DownloadHelpers.DownloadProgressMessage):
-        print(f"Received message: {message}")
+            job = engine.submit(request.video, request.output_path, request.audio_only)
+            rows.append((job.uuid, f"{request.video_number}. {request.title}"))
+        self.download_list_model.add_rows(rows)
+
+    def start_as_discovered(self, entries: Iterator[VideoEntry], output_path: str, limit: int = 0):
+        """Starts downloading the link's videos while the playlist is still being listed."""
+        print("Downloading videos as they are discovered.")
+        engine, audio_only = self.start_batch(0)
+        self.discovering = True
+        engine.submit_as_discovered(entries, output_path, audio_only, limit)
+
+    def on_messages_received(self, messages: List['DownloadProgressMessage']):
+        # New rows are added first, then only the latest progress value per download is applied, before any events.
+        latest_progress: dict[str, 'DownloadProgressMessage'] = {}
+        events: List['DownloadProgressMessage'] = []
+        discovered: List[tuple[str, str]] = []
+        for message in messages:
+            if message.type == "discovered":
+                discovered.append((message.uuid, message.value))
+                self.total_threads_to_finish += 1
+            elif message.type == "progress":
+                latest_progress[message.uuid] = message
+            else:
+                events.append(message)
+
+        self.download_list_model.add_rows(discovered)
+        for message in latest_progress.values():
+            self.on_progress_message_received(message)
+        for message in events:
+            self.on_progress_message_received(message)
+        self.download_list_model.flush()
+
+    def check_if_finished(self):
+        if self.discovering or self.threads_finished < self.total_threads_to_finish:
+            return
+
+        self.return_button.setDisabled(False)
+        self.stop_button.setDisabled(True)
+
+        if self.engine is not None:
+            self.engine.shutdown()
 
+    def on_progress_message_received(self, message: 'DownloadProgressMessage'):
         if message.type == "event":
+            print(f"Received message: {message}")
+
             if message.value == "thread finished":
                 self.threads_finished += 1
                 print(f"Current completed thread count: {self.threads_finished}")
-
-                if self.threads_finished >= self.total_threads_to_finish:
-                    self.return_button.setDisabled(False)
-                    self.stop_button.setDisabled(True)
-                    self.message_check_timer.stop()
-
-                    print("Shutting down thread pool.")
-                    if self.thread_pool is not None:
-                        self.thread_pool.shutdown()
+                self.check_if_finished()
+            elif message.value == "discovery finished":
+                self.discovering = False
+                self.check_if_finished()
             elif message.value == "finding streams":
-                self.uuid_list_item_map[message.uuid].update_status("Getting Streams")
+                self.download_list_model.update_status(message.uuid, "Getting Streams")
             elif message.value == "thread started":
-                self.uuid_list_item_map[message.uuid].update_status("Ready")
+                self.download_list_model.update_status(message.uuid, "Ready")
             elif message.value == "started download":
-                self.uuid_list_item_map[message.uuid].update_status("Downloading")
+                self.download_list_model.update_status(message.uuid, "Downloading")
             elif message.value == "started processing":
-                self.uuid_list_item_map[message.uuid].update_status("Processing")
+                self.download_list_model.update_status(message.uuid, "Processing")
             elif message.value == "completed processing":
-                self.uuid_list_item_map[message.uuid].update_status("Finished")
-                self.uuid_list_item_map[message.uuid].update_progress(100)
+                self.download_list_model.update_status(message.uuid, "Finished")
+                self.download_list_model.update_progress(message.uuid, 100)
+            elif message.value == "skipped":
+                self.download_list_model.update_status(message.uuid, "Already Downloaded")
+                self.download_list_model.update_progress(message.uuid, 100)
             elif message.value == "canceled":
-                self.uuid_list_item_map[message.uuid].update_status("Canceled")
+                self.download_list_model.update_status(message.uuid, "Canceled")
             elif message.value == "error":
-                self.uuid_list_item_map[message.uuid].update_status("Encountered Error")
+                self.download_list_model.update_status(message.uuid, "Encountered Error")
 
         elif message.type == "progress":
-            self.uuid_list_item_map[message.uuid].update_progress(message.value)
+            self.download_list_model.update_progress(message.uuid, message.value)
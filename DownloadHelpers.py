@@ -1,17 +1,43 @@
 import os
+import queue
+import shutil
+import struct
 import threading
+import time
 import traceback
+from concurrent.futures import Future
+from concurrent.futures.thread import ThreadPoolExecutor
 from enum import Enum
 from multiprocessing.queues import Queue
 from tempfile import SpooledTemporaryFile
-from typing import NamedTuple, Final
+from typing import NamedTuple, Final, Iterator, Mapping
+from urllib.error import HTTPError
 
-import pytube
 from ffmpeg import ffmpeg
 from pytube import Stream, StreamQuery, YouTube
 
 from AppDataHandler import DataHandler
-from MetadataScraper import add_metadata_mp4, get_metadata_mp4
+from BandwidthLimiter import BandwidthLimiter
+from ConcurrencyController import ConcurrencyController
+from CoverArtCache import CoverArtCache
+from HttpPool import HttpPool
+from LibraryIndex import LibraryIndex
+from MetadataScraper import add_metadata_mp4, build_metadata_mp4, get_metadata_mp4, Metadata
+from PartialDownloads import PartialDownload
+
+
+# Largest range requested at once. Matches pytube's default range size, larger ranges are throttled.
+RANGE_SIZE: Final[int] = 9437184
+# Size of each read from a range response. Used as the starting size when chunk sizes adapt to the connection.
+CHUNK_SIZE: Final[int] = 262144
+MIN_CHUNK_SIZE: Final[int] = 16384
+MAX_CHUNK_SIZE: Final[int] = 4194304
+# Time each read should take, in seconds. Bounds how long a stop request or progress update waits for a read.
+CHUNK_TARGET_TIME: Final[float] = 0.25
+REQUEST_TIMEOUT: Final[int] = 30
+# Number of tracks whose metadata and cover can be fetched at the same time.
+METADATA_WORKERS: Final[int] = 8
+REQUEST_HEADERS: Final[dict[str, str]] = {"User-Agent": "Mozilla/5.0", "accept-language": "en-US,en"}
 
 
 class DownloadErrorCode(Enum):
@@ -25,9 +51,9 @@ class DownloadProgressMessage(NamedTuple):
     Attributes
     ----------
     type : str
-        The message type. ["event", "progress", "error"]
+        The message type. ["event", "progress", "error", "discovered"]
     value : [str, int]
-        The value associated with the message. Event and Error types are string
+        The value associated with the message. Event, Error and Discovered types are string
         while Progress types are int.
     uuid : str
         Unique identifier for the download request.
@@ -42,7 +68,7 @@ class DownloadRequestArgs(NamedTuple):
     Attributes
     ----------
     message_check_frequency : int
-        In milliseconds.
+        In milliseconds. Minimum time between progress messages for the request.
     output_queue : Manager.Queue
         Queue that DownloadProgressMessages are sent to.
     output_folder : str
@@ -55,6 +81,12 @@ class DownloadRequestArgs(NamedTuple):
         The flag to listen to for stop requests.
     uuid : str
         Identifier for the download request.
+    config : Mapping
+        Read-only snapshot of the configuration taken when the batch started.
+    stream_remux : bool
+        True to feed the audio stream into ffmpeg while it downloads instead of buffering the whole file first.
+    segments : int
+        Number of byte ranges of the audio stream to download at the same time.
     """
     message_check_frequency: int
     output_queue: Queue
@@ -63,6 +95,114 @@ class DownloadRequestArgs(NamedTuple):
     stop_event: threading.Event
     uuid: str
     video: YouTube
+    config: Mapping
+    stream_remux: bool = False
+    segments: int = 1
+
+
+class ProgressReporter:
+    """
+    Coalesces progress updates for a download request. A message is only put on the output queue when the
+    percentage has changed and the minimum interval has passed since the last message, so queue traffic
+    scales with the number of downloads rather than the number of chunks.
+    """
+
+    def __init__(self, output_queue: Queue, uuid: str, min_interval: int):
+        """
+        :param output_queue: Queue to send progress messages.
+        :param uuid: Download request uuid.
+        :param min_interval: In milliseconds.
+        """
+        self.output_queue = output_queue
+        self.uuid = uuid
+        self.min_interval = min_interval / 1000
+        self.last_sent_value: int | None = None
+        self.last_sent_time: float = 0.0
+        self.pending_value: int | None = None
+
+    def report(self, value: int):
+        """Records the latest progress and sends it if it is due."""
+        if value == self.last_sent_value:
+            self.pending_value = None
+            return
+
+        self.pending_value = value
+        if time.monotonic() - self.last_sent_time >= self.min_interval:
+            self.flush()
+
+    def flush(self):
+        """Sends the latest unsent progress value, if any."""
+        if self.pending_value is None:
+            return
+
+        self.output_queue.put(DownloadProgressMessage(
+            type="progress",
+            value=self.pending_value,
+            uuid=self.uuid
+        ))
+        self.last_sent_value = self.pending_value
+        self.last_sent_time = time.monotonic()
+        self.pending_value = None
+
+
+class ChunkPipe:
+    """
+    File-like pipe that passes downloaded chunks to ffmpeg's stdin while the download is still running.
+    Writes block once max_chunks chunks are waiting, keeping memory per download bounded.
+    """
+
+    def __init__(self, max_chunks: int = 8):
+        self.chunks = queue.Queue(maxsize=max_chunks)
+        self.buffer = b""
+        self.aborted = threading.Event()
+        self.finished_reading = False
+
+    def write(self, chunk: bytes):
+        """Adds a chunk to the pipe. Raises BrokenPipeError if the reader has gone away."""
+        while True:
+            if self.aborted.is_set():
+                raise BrokenPipeError("The ffmpeg pipe was closed.")
+            try:
+                self.chunks.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def read(self, size: int = -1) -> bytes:
+        """Reads up to size bytes, blocking until data is available. Returns b"" once the pipe is closed."""
+        if self.aborted.is_set():
+            return b""
+
+        if len(self.buffer) == 0 and not self.finished_reading:
+            chunk = self.chunks.get()
+            if chunk is None or self.aborted.is_set():
+                self.finished_reading = True
+                return b""
+            else:
+                self.buffer = chunk
+
+        if size < 0 or size >= len(self.buffer):
+            data, self.buffer = self.buffer, b""
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def close(self):
+        """Marks the end of the stream once every chunk has been written."""
+        self.write(None)
+
+    def abort(self):
+        """Stops both ends of the pipe without waiting for the remaining chunks to be read."""
+        self.aborted.set()
+        while True:
+            try:
+                self.chunks.get_nowait()
+            except queue.Empty:
+                break
+        try:
+            self.chunks.put_nowait(None)
+        except queue.Full:
+            pass
 
 
 def convert_to_file_name(name: str):
@@ -100,9 +240,10 @@ def download_stream(link: str):
 
 
 def download_stream(stream: Stream, output_file: SpooledTemporaryFile, output_queue: Queue, uuid: str,
-                    stop_event: threading.Event) -> DownloadErrorCode:
+                    stop_event: threading.Event, message_check_frequency: int = 100) -> DownloadErrorCode:
     """
     Downloads the provided stream at the provided file location.
+    :param message_check_frequency: Minimum time between progress messages in milliseconds.
     :param stop_event: The stop flag to look for.
     :param uuid: Download request uuid.
     :param output_queue: Queue to send progress messages.
@@ -110,6 +251,7 @@ def download_stream(stream: Stream, output_file: SpooledTemporaryFile, output_qu
     :param output_file: The location to store the download.
     :return: The error code.
     """
+    reporter = ProgressReporter(output_queue, uuid, message_check_frequency)
     try:
         if stop_event.is_set():
             return DownloadErrorCode.CANCELED
@@ -119,16 +261,12 @@ def download_stream(stream: Stream, output_file: SpooledTemporaryFile, output_qu
             value="started stream",
             uuid=uuid
         ))
-        output_queue.put(DownloadProgressMessage(
-            type="progress",
-            value=0,
-            uuid=uuid
-        ))
+        reporter.report(0)
 
         file_size: int = stream.filesize
         downloaded: float = 0.0
 
-        for chunk in pytube.streams.request.stream(stream.url):
+        for chunk in request_range(stream.url, 0, file_size - 1, stop_event=stop_event):
             if stop_event.is_set():
                 return DownloadErrorCode.CANCELED
 
@@ -136,12 +274,9 @@ def download_stream(stream: Stream, output_file: SpooledTemporaryFile, output_qu
             output_file.write(chunk)
             downloaded += len(chunk)
 
-            output_queue.put(DownloadProgressMessage(
-                type="progress",
-                value=int(downloaded / file_size * 95),
-                uuid=uuid
-            ))
+            reporter.report(int(downloaded / file_size * 95))
 
+        reporter.flush()
         output_queue.put(DownloadProgressMessage(
             type="event",
             value="completed stream",
@@ -154,47 +289,433 @@ def download_stream(stream: Stream, output_file: SpooledTemporaryFile, output_qu
         return DownloadErrorCode.ERROR
 
 
-def download_with_progress(ars: DownloadRequestArgs) -> None:
+class AdaptiveChunkSizer:
     """
-    Attempts to download a YouTube video with the ability to send progress reports and receive pause/cancel requests.
-    :return: None
+    Picks the read size for a download from its measured throughput, so every read takes about CHUNK_TARGET_TIME.
+    Fast connections read in large chunks and slow ones in small chunks that still check for stops regularly.
     """
-    print(f"Beginning to download {ars.video.title}.")
+    # Weight of the newest throughput sample.
+    SMOOTHING: Final[float] = 0.3
+
+    def __init__(self, initial_size: int = MIN_CHUNK_SIZE):
+        """
+        :param initial_size: Size of the first read. Small so slow connections measure their throughput quickly.
+        """
+        self.size = initial_size
+        self.throughput: float | None = None
+
+    def record(self, byte_count: int, seconds: float):
+        """Updates the chunk size with the time a read took."""
+        if byte_count <= 0:
+            return
+
+        sample = byte_count / max(seconds, 0.001)
+        if self.throughput is None:
+            self.throughput = sample
+        else:
+            self.throughput += self.SMOOTHING * (sample - self.throughput)
+
+        size = int(self.throughput * CHUNK_TARGET_TIME)
+        # Whole multiples of the minimum keep reads aligned.
+        self.size = max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, size - size % MIN_CHUNK_SIZE))
+
+
+def request_range(url: str, start: int, end: int, sizer: AdaptiveChunkSizer = None,
+                  stop_event: threading.Event = None) -> Iterator[bytes]:
+    """
+    Downloads the inclusive byte range of the stream url, split into requests of at most RANGE_SIZE bytes.
+    The requests reuse pooled connections and their bytes count towards the bandwidth limit.
+    :param url: The stream url.
+    :param start: First byte to download.
+    :param end: Last byte to download.
+    :param sizer: Picks the size of each read. A new one is made if none is provided.
+    :param stop_event: Stops waiting for the bandwidth limit once set.
+    :return: The downloaded chunks in order.
+    """
+    sizer = sizer if sizer is not None else AdaptiveChunkSizer()
+    position = start
+    try:
+        while position <= end:
+            stop_position = min(position + RANGE_SIZE, end + 1) - 1
+            ConcurrencyController.record_request()
+            with HttpPool.open(f"{url}&range={position}-{stop_position}", REQUEST_HEADERS,
+                               REQUEST_TIMEOUT) as response:
+                while True:
+                    read_start = time.monotonic()
+                    chunk = response.read(sizer.size)
+                    if not chunk:
+                        break
+                    # Segments of a stream share the url, so they share one turn at the limiter. The wait counts as
+                    # part of the read so chunks shrink to the download's share of the limit.
+                    BandwidthLimiter.consume(url, len(chunk), stop_event)
+                    sizer.record(len(chunk), time.monotonic() - read_start)
+                    ConcurrencyController.record_bytes(len(chunk))
+                    position += len(chunk)
+                    yield chunk
+
+            if position <= stop_position:
+                raise ConnectionError(f"Range {position}-{stop_position} ended early.")
+
+    except HTTPError as e:
+        ConcurrencyController.record_failure(e.code)
+        raise
+    except Exception:
+        ConcurrencyController.record_failure()
+        raise
+
+
+def download_stream_resumable(stream: Stream, partial: PartialDownload, output_queue: Queue, uuid: str,
+                              stop_event: threading.Event, message_check_frequency: int = 100) -> DownloadErrorCode:
+    """
+    Downloads the unfinished byte ranges of the partial download at the same time, writing each at its offset in
+    the part file. The part file and its journal are kept if the download is canceled or fails so it can resume.
+    :param message_check_frequency: Minimum time between progress messages in milliseconds.
+    :param stop_event: The stop flag to look for.
+    :param uuid: Download request uuid.
+    :param output_queue: Queue to send progress messages.
+    :param stream: The stream to download.
+    :param partial: The part file to download into.
+    :return: The error code.
+    """
+    reporter = ProgressReporter(output_queue, uuid, message_check_frequency)
+    progress_lock = threading.Lock()
+    segment_failed = threading.Event()
+    file_size: int = stream.filesize
+    downloaded = partial.bytes_done
+
+    def download_segment(index: int, start: int, end: int) -> DownloadErrorCode:
+        nonlocal downloaded
+        try:
+            for chunk in request_range(stream.url, start, end, stop_event=stop_event):
+                if stop_event.is_set():
+                    return DownloadErrorCode.CANCELED
+                if segment_failed.is_set():
+                    return DownloadErrorCode.ERROR
+
+                partial.write(index, chunk)
+                with progress_lock:
+                    downloaded += len(chunk)
+                    reporter.report(int(downloaded / file_size * 95))
+
+            return DownloadErrorCode.NONE
+
+        except Exception:
+            print(traceback.format_exc())
+            segment_failed.set()
+            return DownloadErrorCode.ERROR
+
+    try:
+        if stop_event.is_set():
+            return DownloadErrorCode.CANCELED
+
+        output_queue.put(DownloadProgressMessage(
+            type="event",
+            value="started stream",
+            uuid=uuid
+        ))
+        reporter.report(int(downloaded / file_size * 95))
+
+        ranges = partial.remaining_ranges()
+        with ThreadPoolExecutor(max_workers=max(1, len(ranges))) as executor:
+            results = list(executor.map(lambda segment: download_segment(*segment), ranges))
+
+        if DownloadErrorCode.ERROR in results:
+            return DownloadErrorCode.ERROR
+        if DownloadErrorCode.CANCELED in results:
+            return DownloadErrorCode.CANCELED
+
+        if not partial.verify():
+            print(f"Downloaded {partial.bytes_done} bytes, expected {file_size}. Restarting the download next time.")
+            partial.delete()
+            return DownloadErrorCode.ERROR
+
+        reporter.flush()
+        output_queue.put(DownloadProgressMessage(
+            type="event",
+            value="completed stream",
+            uuid=uuid
+        ))
+        return DownloadErrorCode.NONE
+
+    except Exception:
+        print(traceback.format_exc())
+        return DownloadErrorCode.ERROR
+
+    finally:
+        partial.save_journal(force=True)
+
+
+def download_and_remux_stream(stream: Stream, output_path: str, ars: DownloadRequestArgs) -> DownloadErrorCode:
+    """
+    Feeds the stream into ffmpeg as it downloads so the transfer and the remux overlap.
+    The output file is removed if the download does not complete.
+    :param stream: The audio stream to download.
+    :param output_path: Where ffmpeg writes the remuxed file.
+    :param ars: The download request.
+    :return: The error code.
+    """
+    pipe = ChunkPipe()
+    mpeg = (
+        ffmpeg.FFmpeg(ars.config[DataHandler.ffmpeg_key])
+        .option("y").input("pipe:0").output(
+            output_path,
+            codec="copy"
+        )
+    )
+    remux_errors = []
+
+    def remux():
+        try:
+            mpeg.execute(stream=pipe)
+        except Exception as exe:
+            remux_errors.append(exe)
+            pipe.abort()
+
+    remux_thread = threading.Thread(target=remux, daemon=True)
+    remux_thread.start()
+
+    error_code = download_stream(stream, pipe, ars.output_queue, ars.uuid, ars.stop_event,
+                                 ars.message_check_frequency)
+    if error_code == DownloadErrorCode.NONE:
+        try:
+            pipe.close()
+        except BrokenPipeError:
+            error_code = DownloadErrorCode.ERROR
+    else:
+        pipe.abort()
+        try:
+            mpeg.terminate()
+        except Exception:
+            pass
+
+    remux_thread.join()
+    if len(remux_errors) > 0:
+        print("".join(traceback.format_exception(remux_errors[0])))
+        if error_code == DownloadErrorCode.NONE:
+            error_code = DownloadErrorCode.ERROR
+
+    if error_code != DownloadErrorCode.NONE and os.path.exists(output_path):
+        os.remove(output_path)
+
+    return error_code
+
+
+# Fetches metadata and covers while the streams download.
+metadata_executor = ThreadPoolExecutor(max_workers=METADATA_WORKERS, thread_name_prefix="metadata")
+
+
+class TrackDetails(NamedTuple):
+    """
+    Attributes
+    ----------
+    metadata : Metadata
+        Metadata to embed in the output file.
+    cover : bytes
+        The cover image, or None if it couldn't be fetched ahead of time.
+    """
+    metadata: Metadata
+    cover: bytes | None
+
+
+def get_track_details(video: YouTube) -> TrackDetails:
+    """Gets the metadata and cover of the video."""
+    metadata = get_metadata_mp4(video)
+    try:
+        cover = CoverArtCache.get(metadata.cover_url)
+    except Exception as e:
+        # Tried again when tagging.
+        print(f"Unable to get cover for '{metadata.video_id}'. {e}")
+        cover = None
+    return TrackDetails(metadata, cover)
+
+
+def get_file_name(metadata: Metadata) -> str:
+    """File system safe name for the track, without the extension."""
+    return convert_to_file_name(f"{metadata.title} - {metadata.author}")
+
+
+class FetchedDownload(NamedTuple):
+    """
+    A download request whose streams have finished downloading and are waiting to be processed.
+
+    Attributes
+    ----------
+    details : Future[TrackDetails]
+        The metadata and cover, fetched while the streams download.
+    extension : str
+        Extension for the output file.
+    audio_file : PartialDownload
+        The part file holding the downloaded audio stream.
+    video_file : SpooledTemporaryFile
+        The downloaded video stream, or None for audio only requests.
+    """
+    details: Future
+    extension: str
+    audio_file: PartialDownload | None
+    video_file: SpooledTemporaryFile | None
+
+
+def read_top_level_atoms(path: str) -> list[bytes]:
+    """
+    Lists the types of the top level atoms of an mp4 file without reading their contents.
+    :param path: Path to the file.
+    :return: The atom types in file order.
+    """
+    atoms = []
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        position = 0
+        while position + 8 <= file_size:
+            file.seek(position)
+            size, atom_type = struct.unpack(">I4s", file.read(8))
+            if size == 1:
+                size = struct.unpack(">Q", file.read(8))[0]
+            elif size == 0:
+                size = file_size - position
+            if size < 8 or position + size > file_size:
+                raise ValueError(f"Invalid atom size in '{path}'.")
+
+            atoms.append(atom_type)
+            position += size
+    return atoms
+
+
+def needs_remux(path: str) -> bool:
+    """
+    Checks if a downloaded mp4 stream has to go through ffmpeg before it can be tagged and played.
+    Malformed files and fragmented (DASH) files are remuxed: many players show the wrong duration or can't seek in
+    fragmented m4a files. YouTube serves most audio as fragmented mp4, so only plain files skip ffmpeg.
+    """
+    try:
+        atoms = read_top_level_atoms(path)
+    except (OSError, ValueError, struct.error):
+        return True
+
+    return len(atoms) == 0 or atoms[0] != b"ftyp" or b"moov" not in atoms or b"moof" in atoms
+
+
+def move_file(source: str, destination: str):
+    """Moves the file, replacing the destination. Copies it if they are on different drives."""
+    try:
+        os.replace(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+        os.remove(source)
+
+
+def send_event(ars: DownloadRequestArgs, value: str):
+    """Puts an event message for the download request on its output queue."""
     ars.output_queue.put(DownloadProgressMessage(
         type="event",
-        value="thread started",
+        value=value,
         uuid=ars.uuid
     ))
 
-    metadata = get_metadata_mp4(ars.video)
 
-    # https://docs.python.org/3/library/tempfile.html#tempfile.NamedTemporaryFile
-    audio_temp_file = SpooledTemporaryFile(max_size=25000000, mode='wb+', suffix=".mp4")
+def close_fetched_download(fetched: FetchedDownload, processed: bool):
+    """
+    Closes the files of a fetched download. The audio part file is only deleted once it has been processed,
+    otherwise it is kept so the download can resume.
+    """
+    if fetched.audio_file is not None:
+        if processed:
+            fetched.audio_file.delete()
+        else:
+            fetched.audio_file.close()
+    if fetched.video_file is not None:
+        fetched.video_file.close()
+
+
+def handle_stream_error_code(ars: DownloadRequestArgs, error_code: DownloadErrorCode) -> bool:
+    """
+    Sends the event for a failed stream download.
+    :return: True if the stream downloaded successfully.
+    """
+    if error_code == DownloadErrorCode.CANCELED:
+        send_event(ars, "canceled")
+        return False
+    if error_code == DownloadErrorCode.ERROR:
+        send_event(ars, "error")
+        return False
+    return True
+
+
+def download_and_process_stream(ars: DownloadRequestArgs, details: Future, extension: str,
+                                audio_stream: Stream) -> None:
+    """
+    Downloads and remuxes the audio stream at the same time, then embeds the metadata. The remux is written to the
+    cache folder, since the file name depends on the metadata that is still being fetched.
+    :return: None
+    """
+    library_index = LibraryIndex.get(ars.output_folder)
+    os.makedirs(DataHandler.get_partial_download_dir(), exist_ok=True)
+    remux_file = os.path.join(DataHandler.get_partial_download_dir(), f"{ars.video.video_id}_{ars.uuid}{extension}")
+    error_code = download_and_remux_stream(audio_stream, remux_file, ars)
+    if not handle_stream_error_code(ars, error_code):
+        return
+
+    send_event(ars, "completed download")
+    send_event(ars, "started processing")
+
+    output_file = None
+    try:
+        metadata, cover = details.result()
+        add_metadata_mp4(remux_file, metadata, cover)
+        output_file = library_index.reserve_path(get_file_name(metadata), extension)
+        move_file(remux_file, output_file)
+        library_index.add(metadata.video_id)
+        send_event(ars, "completed processing")
+    except:
+        print(traceback.format_exc())
+        send_event(ars, "error")
+        if output_file is not None:
+            library_index.release_path(output_file)
+        if os.path.exists(remux_file):
+            os.remove(remux_file)
+
+
+def fetch_download(ars: DownloadRequestArgs) -> FetchedDownload | None:
+    """
+    Downloads the streams for the request. The audio is downloaded into a resumable part file. When the request
+    uses stream remuxing the download is also processed here.
+    :return: The fetched download, or None if there is nothing left to process.
+    """
+    send_event(ars, "thread started")
+
+    # Checked before anything is requested from YouTube.
+    if not LibraryIndex.get(ars.output_folder).claim(ars.video.video_id, ars.uuid):
+        print(f"Skipping '{ars.video.video_id}', it is already in the output folder.")
+        send_event(ars, "skipped")
+        return None
+
+    print(f"Beginning to download {ars.video.title}.")
+
+    # Runs alongside the stream download and is joined just before tagging.
+    details = metadata_executor.submit(get_track_details, ars.video)
 
+    # https://docs.python.org/3/library/tempfile.html#tempfile.NamedTemporaryFile
     if not ars.audio_only:
         video_temp_file = SpooledTemporaryFile(max_size=25000000, mode='wb+', suffix=".mp4")
     else:
         video_temp_file = None
 
-    file_system_safe_name: str = convert_to_file_name(f"{metadata.title} - {metadata.author}")
+    fetched = FetchedDownload(
+        details=details,
+        extension=".m4a" if ars.audio_only else ".mp4",
+        audio_file=None,
+        video_file=video_temp_file
+    )
 
     try:
-        ars.output_queue.put(DownloadProgressMessage(
-            type="event",
-            value="finding streams",
-            uuid=ars.uuid
-        ))
+        send_event(ars, "finding streams")
 
         if not ars.audio_only:
             raise NotImplementedError("Video download is currently unsupported.")
 
         if ars.stop_event.is_set():
-            ars.output_queue.put(DownloadProgressMessage(
-                type="event",
-                value="canceled",
-                uuid=ars.uuid
-            ))
-            return
+            send_event(ars, "canceled")
+            close_fetched_download(fetched, False)
+            return None
 
         # Get streams.
         audio_stream = StreamQuery(ars.video.streams).get_audio_only()
@@ -204,130 +725,121 @@ def download_with_progress(ars: DownloadRequestArgs) -> None:
             video_stream = None
 
         # Start stream downloads.
-        ars.output_queue.put(DownloadProgressMessage(
-            type="event",
-            value="started download",
-            uuid=ars.uuid
-        ))
+        send_event(ars, "started download")
+
+        # Remux the audio while it downloads.
+        if ars.stream_remux and ars.audio_only and audio_stream:
+            close_fetched_download(fetched, False)
+            download_and_process_stream(ars, details, fetched.extension, audio_stream)
+            return None
 
         # Get audio.
-        if audio_temp_file and audio_stream:
-            error_code = download_stream(audio_stream, audio_temp_file, ars.output_queue, ars.uuid,
-                                         ars.stop_event)
-            if error_code == DownloadErrorCode.CANCELED:
-                ars.output_queue.put(DownloadProgressMessage(
-                    type="event",
-                    value="canceled",
-                    uuid=ars.uuid
-                ))
-                return
-            if error_code == DownloadErrorCode.ERROR:
-                ars.output_queue.put(DownloadProgressMessage(
-                    type="event",
-                    value="error",
-                    uuid=ars.uuid
-                ))
-                return
+        if audio_stream:
+            fetched = fetched._replace(audio_file=PartialDownload.open(
+                ars.video.video_id, audio_stream.itag, audio_stream.filesize, ars.segments))
+            error_code = download_stream_resumable(audio_stream, fetched.audio_file, ars.output_queue, ars.uuid,
+                                                   ars.stop_event, ars.message_check_frequency)
+            if not handle_stream_error_code(ars, error_code):
+                close_fetched_download(fetched, False)
+                return None
 
         # Get video.
         if video_temp_file and video_stream:
             error_code = download_stream(video_stream, video_temp_file, ars.output_queue, ars.uuid,
-                                         ars.stop_event)
-            if error_code == DownloadErrorCode.CANCELED:
-                ars.output_queue.put(DownloadProgressMessage(
-                    type="event",
-                    value="canceled",
-                    uuid=ars.uuid
-                ))
-                return
-            if error_code == DownloadErrorCode.ERROR:
-                ars.output_queue.put(DownloadProgressMessage(
-                    type="event",
-                    value="error",
-                    uuid=ars.uuid
-                ))
-                return
+                                         ars.stop_event, ars.message_check_frequency)
+            if not handle_stream_error_code(ars, error_code):
+                close_fetched_download(fetched, False)
+                return None
 
-        ars.output_queue.put(DownloadProgressMessage(
-            type="event",
-            value="completed download",
-            uuid=ars.uuid
-        ))
+        send_event(ars, "completed download")
+        return fetched
 
-        # Process downloads.
-        ars.output_queue.put(DownloadProgressMessage(
-            type="event",
-            value="started processing",
-            uuid=ars.uuid
-        ))
-
-        if ars.audio_only:
-            extension = ".m4a"
-        else:
-            extension = ".mp4"
+    except:
+        print(traceback.format_exc())
+        send_event(ars, "error")
+        close_fetched_download(fetched, False)
+        return None
 
-        remux_output_file: str = os.path.join(ars.output_folder, file_system_safe_name + extension)
-        attempts: int = 0
-        MAX_ATTEMPTS: int = 5
 
-        # Get valid location.
-        while os.path.exists(remux_output_file):
-            attempts += 1
-            if attempts >= MAX_ATTEMPTS:
-                raise FileExistsError(f"Too many files with the name '{file_system_safe_name + extension}'.")
-            else:
-                remux_output_file: str = os.path.join(ars.output_folder,
-                                                      f"{file_system_safe_name} ({str(attempts)}){extension}")
+def process_download(ars: DownloadRequestArgs, fetched: FetchedDownload) -> None:
+    """
+    Remuxes the fetched streams into the output folder and embeds the metadata.
+    The files of the fetched download are deleted once it has been processed.
+    :return: None
+    """
+    library_index = LibraryIndex.get(ars.output_folder)
+    remux_output_file = None
+    processed = False
+    try:
+        if ars.stop_event.is_set():
+            send_event(ars, "canceled")
+            return
 
-        try:
-            # Attempt to process downloads.
-            if ars.audio_only:
-                mpeg = (
-                    ffmpeg.FFmpeg(DataHandler.get_config_file_info()[DataHandler.ffmpeg_key])
-                    .option("y").input("pipe:0").output(
-                        remux_output_file,
-                        codec="copy"
-                    )
-                )
+        # Process downloads.
+        send_event(ars, "started processing")
 
-                audio_temp_file.seek(0)
-                mpeg.execute(stream=audio_temp_file.read())
-                add_metadata_mp4(remux_output_file, metadata)
-                ars.output_queue.put(DownloadProgressMessage(
-                    type="event",
-                    value="completed processing",
-                    uuid=ars.uuid
-                ))
+        metadata, cover = fetched.details.result()
 
-        except:
-            print(traceback.format_exc())
-            ars.output_queue.put(DownloadProgressMessage(
-                type="event",
-                value="error",
-                uuid=ars.uuid
-            ))
+        # Get valid location.
+        remux_output_file = library_index.reserve_path(get_file_name(metadata), fetched.extension)
+
+        # Attempt to process downloads.
+        if ars.audio_only and not needs_remux(fetched.audio_file.part_path):
+            # The part file is already a playable container, so it is tagged in place and moved into the folder
+            # instead of being copied by ffmpeg and rewritten again by the tagging.
+            # Anything that can fail before the file changes, like fetching the cover, happens first so the
+            # part file is kept for a retry.
+            tags = build_metadata_mp4(fetched.audio_file.part_path, metadata, cover)
+            fetched.audio_file.close_file()
+            # A tagged part file no longer matches its journal, so it can't be resumed either way.
+            processed = True
+            tags.save()
+            move_file(fetched.audio_file.part_path, remux_output_file)
+            library_index.add(metadata.video_id)
+            send_event(ars, "completed processing")
+
+        elif ars.audio_only:
+            mpeg = (
+                ffmpeg.FFmpeg(ars.config[DataHandler.ffmpeg_key])
+                .option("y").input(fetched.audio_file.part_path).output(
+                    remux_output_file,
+                    codec="copy"
+                )
+            )
 
-            # Cleanup.
-            if os.path.exists(remux_output_file):
-                os.remove(remux_output_file)
+            # ffmpeg reads the part file directly.
+            mpeg.execute()
+            add_metadata_mp4(remux_output_file, metadata, cover)
+            library_index.add(metadata.video_id)
+            processed = True
+            send_event(ars, "completed processing")
 
     except:
-        print(traceback.print_exc())
-        ars.output_queue.put(DownloadProgressMessage(
-            type="event",
-            value="error",
-            uuid=ars.uuid
-        ))
+        print(traceback.format_exc())
+        send_event(ars, "error")
+
+        # Cleanup.
+        if remux_output_file is not None:
+            library_index.release_path(remux_output_file)
 
     finally:
-        # Delete temporary files.
-        if audio_temp_file is not None:
-            audio_temp_file.close()
-        if video_temp_file is not None:
-            video_temp_file.close()
+        close_fetched_download(fetched, processed)
 
-        ars.output_queue.put(DownloadProgressMessage(
-            type="event",
-            value="thread finished",
-            uuid=ars.uuid
-        ))
+
+def finish_download(ars: DownloadRequestArgs) -> None:
+    """Reports that nothing else will run for the download request."""
+    LibraryIndex.get(ars.output_folder).release(ars.video.video_id, ars.uuid)
+    send_event(ars, "thread finished")
+
+
+def download_with_progress(ars: DownloadRequestArgs) -> None:
+    """
+    Attempts to download a YouTube video with the ability to send progress reports and receive pause/cancel requests.
+    :return: None
+    """
+    try:
+        fetched = fetch_download(ars)
+        if fetched is not None:
+            process_download(ars, fetched)
+    finally:
+        finish_download(ars)
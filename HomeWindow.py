@@ -1,15 +1,13 @@
 from os import path
-from typing import List
+from typing import List, Iterator
 
-import pytube
 from PyQt6.QtWidgets import QMainWindow, QPushButton, QLabel, QLineEdit, \
     QFileDialog, QHBoxLayout, QWidget, QStackedWidget, QFormLayout
-from pytube import YouTube
-import yt_dlp
 
 from AppDataHandler import DataHandler
-from CustomWidgets import LabeledSpinbox, ErrorDialog
+from CustomWidgets import LabeledSpinbox, ErrorDialog, LabeledCheckbox
 from DownloadHandler import DownloadViewer, DownloadRequest
+from LinkResolver import resolve_link, iter_link_entries, VideoEntry
 from StreamViewer import StreamViewer
 
 
@@ -28,14 +26,17 @@ class MainWindow(QMainWindow):
         self.stream_viewer.add_on_cancel_callback(self.open_home)
         self.stream_viewer.add_on_start_downloads_callback(self.open_downloads)
         self.home.add_get_streams_callback(self.open_stream_viewer)
-        self.download_viewer.register_go_back_callback(self.return_to_stream_viewer)
+        self.home.add_download_as_discovered_callback(self.open_downloads_as_discovered)
+        self.download_viewer.register_go_back_callback(self.leave_downloads)
         self.central_widget.addWidget(self.home)
         self.central_widget.addWidget(self.stream_viewer)
         self.central_widget.addWidget(self.download_viewer)
 
+        # True while the download viewer was opened straight from home, skipping the stream viewer.
+        self.downloads_opened_from_home = False
         self.open_home()
 
-    def open_stream_viewer(self, urls: List[YouTube], output_path: str):
+    def open_stream_viewer(self, urls: List[VideoEntry], output_path: str):
         print("Opening stream viewer.")
         self.setWindowTitle("Music Maker 2.0 - Stream Viewer")
         self.central_widget.setCurrentWidget(self.stream_viewer)
@@ -49,9 +50,24 @@ class MainWindow(QMainWindow):
     def open_downloads(self, download_list: List[DownloadRequest]):
         print("Opening download viewer.")
         self.setWindowTitle("Music Maker 2.0 - Download Viewer")
+        self.downloads_opened_from_home = False
         self.central_widget.setCurrentWidget(self.download_viewer)
         self.download_viewer.set_download_list(download_list)
 
+    def open_downloads_as_discovered(self, entries: Iterator[VideoEntry], output_path: str, limit: int):
+        print("Opening download viewer.")
+        self.setWindowTitle("Music Maker 2.0 - Download Viewer")
+        self.downloads_opened_from_home = True
+        self.central_widget.setCurrentWidget(self.download_viewer)
+        self.download_viewer.start_as_discovered(entries, output_path, limit)
+
+    def leave_downloads(self):
+        """Goes back to the window the download viewer was opened from."""
+        if self.downloads_opened_from_home:
+            self.open_home()
+        else:
+            self.return_to_stream_viewer()
+
     def return_to_stream_viewer(self):
         print("Returning to stream viewer.")
         self.setWindowTitle("Music Maker 2.0 - Stream Viewer")
@@ -64,6 +80,7 @@ class HomeWindow(QWidget):
 
         print("Init home window.")
         self.on_get_streams_callbacks = []
+        self.on_download_as_discovered_callbacks = []
 
         # Start button.
         self.getStreamsButton = QPushButton("Get Streams")
@@ -98,8 +115,13 @@ class HomeWindow(QWidget):
         # Footer selectors.
         self.simultaneousDownloads = LabeledSpinbox("Simultaneous\nDownloads")
         self.simultaneousProcesses = LabeledSpinbox("Simultaneous\nProcesses")
-        self.simultaneousProcesses.setDisabled(True)
         self.max_downloads = LabeledSpinbox("Max Downloads\n(0 = unlimited)", 0)
+        self.download_segments = LabeledSpinbox("Segments Per\nDownload", 1, 16)
+        self.download_as_discovered = LabeledCheckbox("Download As\nDiscovered?")
+        self.async_downloads = LabeledCheckbox("Async\nDownloads?")
+        self.adaptive_downloads = LabeledCheckbox("Auto Tune\nDownloads?")
+        # The async engine doesn't auto tune, so the option only applies to threaded downloads.
+        self.async_downloads.check_box.toggled.connect(self.on_async_downloads_toggled)
 
         # Layout
         v_box = QFormLayout(self)
@@ -122,6 +144,10 @@ class HomeWindow(QWidget):
         footer_h_box.addWidget(self.simultaneousDownloads)
         footer_h_box.addWidget(self.simultaneousProcesses)
         footer_h_box.addWidget(self.max_downloads)
+        footer_h_box.addWidget(self.download_segments)
+        footer_h_box.addWidget(self.download_as_discovered)
+        footer_h_box.addWidget(self.async_downloads)
+        footer_h_box.addWidget(self.adaptive_downloads)
         footer_h_box.addWidget(self.getStreamsButton)
         v_box.addRow(footer_h_box)
 
@@ -135,6 +161,14 @@ class HomeWindow(QWidget):
         self.simultaneousDownloads.set_value(preferences[DataHandler.sim_download_key])
         self.simultaneousProcesses.set_value(preferences[DataHandler.sim_process_key])
         self.max_downloads.set_value(preferences[DataHandler.stream_limit_key])
+        self.download_segments.set_value(preferences[DataHandler.download_segments_key])
+        self.download_as_discovered.check_box.setChecked(preferences[DataHandler.download_as_discovered_key])
+        self.async_downloads.check_box.setChecked(preferences[DataHandler.async_downloads_key])
+        self.adaptive_downloads.check_box.setChecked(preferences[DataHandler.adaptive_downloads_key])
+        self.on_async_downloads_toggled(self.async_downloads.get_value())
+
+    def on_async_downloads_toggled(self, checked: bool):
+        self.adaptive_downloads.setEnabled(not checked)
 
     def get_streams(self):
         """Opens the streams window."""
@@ -147,12 +181,31 @@ class HomeWindow(QWidget):
             return
 
         print("Updating user settings.")
-        DataHandler.update_config_file(DataHandler.url_key, self.urlInput.text())
-        DataHandler.update_config_file(DataHandler.folder_key, self.selectedFolder.text())
-        DataHandler.update_config_file(DataHandler.ffmpeg_key, self.selectedFile.text())
-        DataHandler.update_config_file(DataHandler.sim_download_key, self.simultaneousDownloads.get_value())
-        DataHandler.update_config_file(DataHandler.sim_process_key, self.simultaneousProcesses.get_value())
-        DataHandler.update_config_file(DataHandler.stream_limit_key, self.max_downloads.get_value())
+        DataHandler.update_config_entries({
+            DataHandler.url_key: self.urlInput.text(),
+            DataHandler.folder_key: self.selectedFolder.text(),
+            DataHandler.ffmpeg_key: self.selectedFile.text(),
+            DataHandler.sim_download_key: self.simultaneousDownloads.get_value(),
+            DataHandler.sim_process_key: self.simultaneousProcesses.get_value(),
+            DataHandler.stream_limit_key: self.max_downloads.get_value(),
+            DataHandler.download_segments_key: self.download_segments.get_value(),
+            DataHandler.download_as_discovered_key: self.download_as_discovered.get_value(),
+            DataHandler.async_downloads_key: self.async_downloads.get_value(),
+            DataHandler.adaptive_downloads_key: self.adaptive_downloads.get_value()
+        })
+
+        if self.download_as_discovered.get_value():
+            # Skips the stream viewer. Only the link is requested here, its videos are listed while downloading.
+            print("Downloading as discovered.")
+            try:
+                entries = iter_link_entries(self.urlInput.text())
+            except Exception as e:
+                self.show_invalid_link_error(e)
+                return
+
+            for callback in self.on_download_as_discovered_callbacks:
+                callback(entries, self.selectedFolder.text(), self.max_downloads.get_value())
+            return
 
         print("Getting streams.")
         self.raise_get_streams_callback()
@@ -204,58 +257,35 @@ class HomeWindow(QWidget):
             return (f"Invalid file path '{self.selectedFile.text()}'.\n"
                     f"Make sure you select a valid ffmpeg executable.")
 
-
-
-        # Check if video/playlist exists.
-        try:
-            print(f"Playlist ID: {pytube.Playlist(self.urlInput.text()).playlist_id}")
-
-        except KeyError:
-            print("Link is not a playlist.")
-
-            try:
-                length = pytube.YouTube(self.urlInput.text()).length
-                print(f"Valid video link. {length}s")
-            except:
-                return "Invalid video link. (Link may be mistyped, the video may be private or otherwise unavailable.)"
-
-        except:
-            return "Unknown error."
-
-        finally:
-            print("Completed link validation.")
-
         # Completed checks.
         return ""
 
     def add_get_streams_callback(self, callback):
-        """Callback requires a List[str] parameter."""
+        """Callback requires (videos: List[VideoEntry], output_path: str) parameters."""
 
         self.on_get_streams_callbacks.append(callback)
 
-    def raise_get_streams_callback(self):
-        try:
-            with yt_dlp.YoutubeDL({"ignoreerrors": True, "quiet": True}) as ydl:
-                playlist_dict = ydl.extract_info(self.urlInput.text(), download=False)
-                print(playlist_dict.get("title"))
+    def add_download_as_discovered_callback(self, callback):
+        """Callback requires (entries: Iterator[VideoEntry], output_path: str, limit: int) parameters."""
 
-            video_metadata = []
-            for video in playlist_dict["entries"]:
-                video_metadata.append(video)
+        self.on_download_as_discovered_callbacks.append(callback)
 
+    def raise_get_streams_callback(self):
+        # Validates and lists the link in one pass.
+        try:
+            videos = resolve_link(self.urlInput.text()).entries
         except Exception as e:
-            print(f"Unable to get video or playlist from url '{self.urlInput.text()}'.\nRecieved error {e}")
+            self.show_invalid_link_error(e)
             return
 
         # Truncate list.
-        max_downloads: int
-        if len(videos) < self.max_downloads.get_value():
-            max_downloads = len(videos)
-        else:
-            max_downloads = self.max_downloads.get_value()
-
         if self.max_downloads.get_value() > 0:
-            videos = videos[:max_downloads]
+            videos = videos[:self.max_downloads.get_value()]
 
         for callback in self.on_get_streams_callbacks:
             callback(videos, self.selectedFolder.text())
+
+    def show_invalid_link_error(self, error: Exception):
+        print(f"Unable to get video or playlist from url '{self.urlInput.text()}'.\nReceived error {error}")
+        ErrorDialog("Error", "Invalid video or playlist link. (Link may be mistyped, the video may be private "
+                             "or otherwise unavailable.)").exec()
@@ -0,0 +1,171 @@
+import http.client
+import threading
+import time
+from contextlib import contextmanager
+from typing import NamedTuple, Final, Iterator
+from urllib.error import HTTPError
+from urllib.parse import urlsplit, urljoin
+
+
+class PoolStats(NamedTuple):
+    """
+    Attributes
+    ----------
+    requests : int
+        Number of requests sent.
+    connections_opened : int
+        Number of new connections made.
+    connections_reused : int
+        Number of requests sent on an idle connection.
+    """
+    requests: int
+    connections_opened: int
+    connections_reused: int
+
+    @property
+    def reuse_rate(self) -> float:
+        return self.connections_reused / self.requests if self.requests > 0 else 0.0
+
+
+class HttpPool:
+    """
+    Keep-alive HTTP connections shared by every thread. A connection goes back to its host's idle list once its
+    response has been read to the end, so later chunks, streams and covers from the same host skip the TCP and
+    TLS handshakes.
+    """
+    # Requests that can be sent to one host at the same time. Further requests wait for a free connection.
+    MAX_CONNECTIONS_PER_HOST: Final[int] = 16
+    # Idle connections older than this are closed instead of reused, in seconds.
+    IDLE_TIMEOUT: Final[float] = 60.0
+    MAX_REDIRECTS: Final[int] = 5
+
+    # (scheme, host, port) -> idle connections and the time they were returned.
+    __idle: dict[tuple[str, str, int], list[tuple[http.client.HTTPConnection, float]]] = {}
+    __host_slots: dict[tuple[str, str, int], threading.BoundedSemaphore] = {}
+    __lock = threading.Lock()
+
+    __requests = 0
+    __connections_opened = 0
+    __connections_reused = 0
+
+    @classmethod
+    @contextmanager
+    def open(cls, url: str, headers: dict[str, str] = None, timeout: float = 30) -> Iterator[http.client.HTTPResponse]:
+        """
+        Sends a GET request, following redirects. Read the response to the end so its connection can be reused.
+        :param url: The url to request.
+        :param headers: Headers to send with the request.
+        :param timeout: Socket timeout in seconds.
+        :return: The response.
+        """
+        for _ in range(cls.MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+            target = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+
+            slot = cls.get_host_slot(key)
+            slot.acquire()
+            try:
+                connection, response = cls.send(key, target, headers or {}, timeout)
+                try:
+                    if response.status in (301, 302, 303, 307, 308) and response.getheader("Location"):
+                        url = urljoin(url, response.getheader("Location"))
+                        response.read()
+                        continue
+                    if response.status >= 400:
+                        raise HTTPError(url, response.status, response.reason, response.headers, None)
+
+                    yield response
+                    return
+
+                finally:
+                    cls.release_connection(key, connection, response)
+            finally:
+                slot.release()
+
+        raise HTTPError(url, 310, "Too many redirects", None, None)
+
+    @classmethod
+    def send(cls, key: tuple[str, str, int], target: str, headers: dict[str, str],
+             timeout: float) -> tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        """Sends the request on an idle connection, or a new one if there is none or the idle one was closed."""
+        connection = cls.take_idle_connection(key)
+        if connection is not None:
+            connection.timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+            try:
+                connection.request("GET", target, headers=headers)
+                response = connection.getresponse()
+                cls.count(reused=True)
+                return connection, response
+            except (http.client.RemoteDisconnected, ConnectionError, http.client.BadStatusLine):
+                # The server closed the idle connection.
+                connection.close()
+
+        scheme, host, port = key
+        if scheme == "https":
+            connection = http.client.HTTPSConnection(host, port, timeout=timeout)
+        else:
+            connection = http.client.HTTPConnection(host, port, timeout=timeout)
+        cls.count(reused=False)
+        try:
+            connection.request("GET", target, headers=headers)
+            return connection, connection.getresponse()
+        except Exception:
+            connection.close()
+            raise
+
+    @classmethod
+    def get_host_slot(cls, key: tuple[str, str, int]) -> threading.BoundedSemaphore:
+        with cls.__lock:
+            return cls.__host_slots.setdefault(key, threading.BoundedSemaphore(cls.MAX_CONNECTIONS_PER_HOST))
+
+    @classmethod
+    def take_idle_connection(cls, key: tuple[str, str, int]) -> http.client.HTTPConnection | None:
+        now = time.monotonic()
+        with cls.__lock:
+            idle = cls.__idle.get(key, [])
+            while len(idle) > 0:
+                connection, returned_time = idle.pop()
+                if now - returned_time < cls.IDLE_TIMEOUT:
+                    return connection
+                connection.close()
+        return None
+
+    @classmethod
+    def release_connection(cls, key: tuple[str, str, int], connection: http.client.HTTPConnection,
+                           response: http.client.HTTPResponse):
+        """Returns the connection to the idle list if its response was read to the end, otherwise closes it."""
+        if not response.isclosed() or response.will_close:
+            connection.close()
+            return
+
+        with cls.__lock:
+            idle = cls.__idle.setdefault(key, [])
+            if len(idle) < cls.MAX_CONNECTIONS_PER_HOST:
+                idle.append((connection, time.monotonic()))
+                return
+        connection.close()
+
+    @classmethod
+    def count(cls, reused: bool):
+        with cls.__lock:
+            cls.__requests += 1
+            if reused:
+                cls.__connections_reused += 1
+            else:
+                cls.__connections_opened += 1
+
+    @classmethod
+    def get_stats(cls) -> PoolStats:
+        with cls.__lock:
+            return PoolStats(cls.__requests, cls.__connections_opened, cls.__connections_reused)
+
+    @classmethod
+    def close_idle_connections(cls):
+        with cls.__lock:
+            for idle in cls.__idle.values():
+                for connection, _ in idle:
+                    connection.close()
+            cls.__idle.clear()
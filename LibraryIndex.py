@@ -0,0 +1,133 @@
+import os
+import threading
+import traceback
+from typing import Final
+
+from mutagen.mp4 import MP4
+
+from MetadataScraper import VIDEO_ID_TAG
+
+
+class LibraryIndex:
+    """
+    Index of the tracks in an output folder, shared by every download into that folder.
+    Knows which videos are already in the folder and hands out file names so that no two downloads use the same one.
+    """
+    EXTENSIONS: Final[tuple[str, ...]] = (".m4a", ".mp4")
+    MAX_ATTEMPTS: Final[int] = 5
+
+    __indexes: dict[str, 'LibraryIndex'] = {}
+    __indexes_lock = threading.Lock()
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.video_ids: set[str] = set()
+        self.file_names: set[str] = set()
+        # Video id -> uuid of the download request currently getting it.
+        self.claims: dict[str, str] = {}
+        self.scan()
+
+    @classmethod
+    def get(cls, folder: str) -> 'LibraryIndex':
+        """Gets the index for the folder, scanning the folder the first time it is requested."""
+        key = os.path.normcase(os.path.abspath(folder))
+        with cls.__indexes_lock:
+            if key not in cls.__indexes:
+                cls.__indexes[key] = LibraryIndex(folder)
+            return cls.__indexes[key]
+
+    @classmethod
+    def invalidate(cls):
+        """
+        Drops the cached indexes so each folder is scanned again the next time it is requested. Files deleted or
+        added outside of the app since the last scan are then picked up. Indexes with claimed videos belong to
+        downloads that are still running, so they are kept.
+        """
+        with cls.__indexes_lock:
+            for key, index in list(cls.__indexes.items()):
+                with index.lock:
+                    if len(index.claims) == 0:
+                        del cls.__indexes[key]
+
+    def scan(self):
+        """Reads the file names and embedded video ids of the tracks in the folder."""
+        print(f"Indexing '{self.folder}'.")
+        if not os.path.isdir(self.folder):
+            return
+
+        for entry in os.scandir(self.folder):
+            if not entry.is_file():
+                continue
+
+            self.file_names.add(os.path.normcase(entry.name))
+            if not entry.name.lower().endswith(self.EXTENSIONS):
+                continue
+
+            try:
+                tags = MP4(entry.path).tags
+                if tags is not None and VIDEO_ID_TAG in tags:
+                    self.video_ids.add(bytes(tags[VIDEO_ID_TAG][0]).decode("utf-8"))
+            except Exception:
+                print(f"Unable to read tags of '{entry.path}'.")
+
+        print(f"Indexed {len(self.file_names)} files and {len(self.video_ids)} videos in '{self.folder}'.")
+
+    def claim(self, video_id: str, uuid: str) -> bool:
+        """
+        Claims the video for a download request.
+        :return: False if the video is already in the folder or being downloaded by another request.
+        """
+        with self.lock:
+            if video_id in self.video_ids or self.claims.get(video_id, uuid) != uuid:
+                return False
+            self.claims[video_id] = uuid
+            return True
+
+    def release(self, video_id: str, uuid: str):
+        """Gives up the request's claim on the video if it did not finish downloading it."""
+        with self.lock:
+            if self.claims.get(video_id) == uuid:
+                del self.claims[video_id]
+
+    def add(self, video_id: str):
+        """Records that the video is now in the folder."""
+        with self.lock:
+            self.video_ids.add(video_id)
+            self.claims.pop(video_id, None)
+
+    def reserve_path(self, name: str, extension: str) -> str:
+        """
+        Reserves a file path in the folder by creating an empty file at it.
+        :param name: File system safe name of the file.
+        :param extension: The file extension.
+        :return: The reserved path.
+        """
+        with self.lock:
+            for attempt in range(self.MAX_ATTEMPTS):
+                file_name = name + extension if attempt == 0 else f"{name} ({str(attempt)}){extension}"
+                if os.path.normcase(file_name) in self.file_names:
+                    continue
+
+                path = os.path.join(self.folder, file_name)
+                try:
+                    os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                except FileExistsError:
+                    self.file_names.add(os.path.normcase(file_name))
+                    continue
+
+                self.file_names.add(os.path.normcase(file_name))
+                return path
+
+        raise FileExistsError(f"Too many files with the name '{name + extension}'.")
+
+    def release_path(self, path: str):
+        """Deletes a reserved file that was not completed and frees its name."""
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except OSError:
+            print(traceback.format_exc())
+
+        with self.lock:
+            self.file_names.discard(os.path.normcase(os.path.basename(path)))
@@ -0,0 +1,119 @@
+from typing import NamedTuple, List, Iterator, Final, TYPE_CHECKING
+
+# yt_dlp and pytube are slow to import, so they are imported when a link is first resolved instead of at startup.
+if TYPE_CHECKING:
+    from pytube import YouTube
+
+
+class VideoEntry(NamedTuple):
+    """
+    Attributes
+    ----------
+    video_id : str
+        The YouTube video id.
+    url : str
+        Watch url of the video.
+    title : str
+        Title of the video. Empty if the playlist listing didn't include it.
+    author : str
+        Uploader of the video. Empty if the playlist listing didn't include it.
+    """
+    video_id: str
+    url: str
+    title: str
+    author: str
+
+    def to_youtube(self) -> 'YouTube':
+        """Creates the pytube video. Nothing is requested from YouTube until its properties are used."""
+        from pytube import YouTube
+        return YouTube(self.url)
+
+
+class ResolvedLink(NamedTuple):
+    """
+    Attributes
+    ----------
+    title : str
+        Title of the playlist or video.
+    entries : List[VideoEntry]
+        The videos of the link in playlist order.
+    """
+    title: str
+    entries: List[VideoEntry]
+
+
+def to_video_entry(info: dict) -> VideoEntry:
+    """Converts a yt_dlp info dict into a video entry."""
+    video_id = info["id"]
+    return VideoEntry(
+        video_id=video_id,
+        url=f"https://www.youtube.com/watch?v={video_id}",
+        title=info.get("title") or "",
+        author=info.get("uploader") or info.get("channel") or ""
+    )
+
+
+YDL_OPTIONS: Final[dict] = {
+    "quiet": True,
+    "ignoreerrors": True,
+    "skip_download": True,
+    "extract_flat": "in_playlist"
+}
+
+
+def resolve_link(url: str) -> ResolvedLink:
+    """
+    Validates and lists a video or playlist link with a single extraction. Playlists are extracted flat, so the
+    number of requests doesn't grow with the number of videos.
+    :param url: The video or playlist link.
+    :return: The resolved link.
+    """
+    import yt_dlp
+    with yt_dlp.YoutubeDL(YDL_OPTIONS) as ydl:
+        info = ydl.extract_info(url, download=False)
+
+    if info is None:
+        raise ValueError(f"Unable to get video or playlist from url '{url}'.")
+
+    if info.get("_type") == "playlist":
+        entries = [to_video_entry(entry) for entry in info["entries"] if entry is not None]
+    else:
+        entries = [to_video_entry(info)]
+
+    print(f"Resolved '{info.get('title')}' with {len(entries)} videos.")
+    return ResolvedLink(info.get("title") or "", entries)
+
+
+def iter_link_entries(url: str) -> Iterator[VideoEntry]:
+    """
+    Yields the videos of a video or playlist link as the playlist pages arrive, instead of waiting for the
+    whole listing. The link itself is requested right away, so an invalid link raises here.
+    :param url: The video or playlist link.
+    :return: The videos in playlist order.
+    """
+    import yt_dlp
+    ydl = yt_dlp.YoutubeDL(YDL_OPTIONS)
+    try:
+        # Without processing, playlist entries are a generator that requests the next page when needed.
+        info = ydl.extract_info(url, download=False, process=False)
+        if info is None:
+            raise ValueError(f"Unable to get video or playlist from url '{url}'.")
+    except BaseException:
+        ydl.close()
+        raise
+
+    return iter_info_entries(ydl, url, info)
+
+
+def iter_info_entries(ydl, url: str, info: dict) -> Iterator[VideoEntry]:
+    """Yields the videos of an unprocessed yt_dlp result, then closes the YoutubeDL that fetches its pages."""
+    with ydl:
+        if info.get("_type") in ("url", "url_transparent"):
+            # The link points at another page, which has to be resolved first.
+            yield from resolve_link(url).entries
+        elif info.get("_type") == "playlist":
+            for entry in info["entries"]:
+                if entry is not None:
+                    yield to_video_entry(entry)
+        else:
+            yield to_video_entry(info)
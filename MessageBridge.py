@@ -0,0 +1,45 @@
+import threading
+
+from PyQt6.QtCore import QObject, pyqtSignal, Qt
+
+
+class MessageBridge(QObject):
+    """
+    Queue-like object that delivers messages put from worker threads to the GUI thread in batches.
+    Only one flush is scheduled at a time, so the GUI thread wakes once per burst of messages
+    instead of polling on a timer.
+    """
+    messages_received = pyqtSignal(list)
+    flush_requested = pyqtSignal()
+
+    def __init__(self, parent: QObject = None):
+        super().__init__(parent)
+        self.lock = threading.Lock()
+        self.pending_messages = []
+        self.flush_scheduled = False
+        self.flush_requested.connect(self.flush, Qt.ConnectionType.QueuedConnection)
+
+    def put(self, message):
+        """Adds a message to the next batch. Safe to call from any thread."""
+        with self.lock:
+            self.pending_messages.append(message)
+            if self.flush_scheduled:
+                return
+            self.flush_scheduled = True
+
+        self.flush_requested.emit()
+
+    def flush(self):
+        """Emits every pending message as one batch. Runs on the thread the bridge belongs to."""
+        with self.lock:
+            messages = self.pending_messages
+            self.pending_messages = []
+            self.flush_scheduled = False
+
+        if len(messages) > 0:
+            self.messages_received.emit(messages)
+
+    def clear(self):
+        """Drops every pending message."""
+        with self.lock:
+            self.pending_messages = []
@@ -1,9 +1,22 @@
-from typing import NamedTuple
-from urllib.request import urlopen
+import sqlite3
+import time
+from typing import NamedTuple, Final
 
-from mutagen.mp4 import MP4Cover, MP4
+from mutagen.mp4 import MP4Cover, MP4, MP4FreeForm
 from pytube import YouTube
 
+from AppDataHandler import DataHandler
+from CoverArtCache import CoverArtCache
+
+# Freeform atom holding the id of the video a track was downloaded from.
+VIDEO_ID_TAG: Final[str] = "----:com.musicmaker:video_id"
+
+# Increase when the parsing in scrape_metadata_mp4 changes so old cache entries are ignored.
+METADATA_CACHE_VERSION: Final[int] = 1
+# How long scraped metadata is reused, in seconds.
+METADATA_CACHE_TIME_TO_LIVE: Final[int] = 2592000
+METADATA_CACHE_KEY_PREFIX: Final[str] = "metadata:"
+
 
 class Metadata(NamedTuple):
     title: str
@@ -11,6 +24,7 @@ class Metadata(NamedTuple):
     album: str
     year: str
     cover_url: str
+    video_id: str = ""
 
 
 def get_description(yt: YouTube):
@@ -28,29 +42,69 @@ def get_description(yt: YouTube):
     return False
 
 
-def add_metadata_mp4(file_path: str, metadata: Metadata):
+def add_metadata_mp4(file_path: str, metadata: Metadata, cover: bytes = None):
     """
     Embeds the metadata to the provided mp4/m4a file.
     :param file_path: Path to the file.
     :param metadata: Metadata to embed.
+    :param cover: The cover image. Fetched from the metadata's cover url if not provided.
     :return: None
     """
+    build_metadata_mp4(file_path, metadata, cover).save()
+
+
+def build_metadata_mp4(file_path: str, metadata: Metadata, cover: bytes = None) -> MP4:
+    """
+    Prepares the tags of the provided mp4/m4a file without changing it. Call save on the result to embed them.
+    :param file_path: Path to the file.
+    :param metadata: Metadata to embed.
+    :param cover: The cover image. Fetched from the metadata's cover url if not provided.
+    :return: The file with its new tags.
+    """
     tags = MP4(file_path)
 
     tags["\xa9nam"] = metadata.title
     tags["\xa9ART"] = metadata.author
     tags["\xa9alb"] = metadata.album
     tags["\xa9day"] = metadata.year
+    if metadata.video_id:
+        tags[VIDEO_ID_TAG] = [MP4FreeForm(metadata.video_id.encode("utf-8"))]
 
-    http_req = urlopen(metadata.cover_url)
-    file = http_req.read()
-    http_req.close()
-    tags["covr"] = [MP4Cover(file, imageformat=MP4Cover.FORMAT_JPEG)]
-
-    tags.save()
+    if cover is None:
+        cover = CoverArtCache.get(metadata.cover_url)
+    tags["covr"] = [MP4Cover(cover, imageformat=MP4Cover.FORMAT_JPEG)]
+    return tags
 
 
 def get_metadata_mp4(video: YouTube) -> Metadata:
+    """
+    Gets the metadata for the provided video, only scraping it if there is no up-to-date cached copy.
+    :param video: The video to get the metadata for.
+    :return: The metadata.
+    """
+    key = METADATA_CACHE_KEY_PREFIX + video.video_id
+    entry = DataHandler.retrieve_cache_file_info(key)
+    if (entry is not None
+            and entry.get("version") == METADATA_CACHE_VERSION
+            and time.time() - entry.get("time", 0) < METADATA_CACHE_TIME_TO_LIVE):
+        meta = Metadata(**entry["metadata"])
+        print("Cached metadata:", meta)
+        return meta
+
+    meta = scrape_metadata_mp4(video)
+    try:
+        DataHandler.update_cache_file(key, {
+            "version": METADATA_CACHE_VERSION,
+            "time": time.time(),
+            "metadata": meta._asdict()
+        })
+    except (OSError, sqlite3.Error):
+        print(f"Unable to cache metadata for '{video.video_id}'.")
+
+    return meta
+
+
+def scrape_metadata_mp4(video: YouTube) -> Metadata:
     """
     Attempts to scrape relevant metadata from the provided video.
     :param video: The video to scrape the metadata from.
@@ -96,7 +150,8 @@ def get_metadata_mp4(video: YouTube) -> Metadata:
         author=artist,
         album=album,
         year=year,
-        cover_url=video.thumbnail_url
+        cover_url=video.thumbnail_url,
+        video_id=video.video_id
     )
     print("Detected metadata:", meta)
     return meta
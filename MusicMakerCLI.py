@@ -0,0 +1,123 @@
+import argparse
+import os
+import sys
+from typing import List
+
+from AppDataHandler import DataHandler
+from DownloadEngine import DownloadEngine
+from LinkResolver import resolve_link, iter_link_entries
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    preferences = DataHandler.get_config_file_info()
+
+    parser = argparse.ArgumentParser(description="Downloads YouTube videos and playlists without the GUI.")
+    parser.add_argument("url", help="YouTube playlist or video link.")
+    parser.add_argument("-o", "--output", default=preferences[DataHandler.folder_key],
+                        help="Folder to put downloaded files in. Defaults to the saved output folder.")
+    parser.add_argument("--ffmpeg", default=preferences[DataHandler.ffmpeg_key],
+                        help="Location of the ffmpeg executable. Defaults to the saved location.")
+    parser.add_argument("-j", "--jobs", type=int, default=preferences[DataHandler.sim_download_key],
+                        help="Number of simultaneous downloads.")
+    parser.add_argument("-p", "--processes", type=int, default=preferences[DataHandler.sim_process_key],
+                        help="Number of downloads remuxed and tagged at the same time.")
+    parser.add_argument("-s", "--segments", type=int, default=preferences[DataHandler.download_segments_key],
+                        help="Number of byte ranges of each stream to download at the same time.")
+    parser.add_argument("-n", "--max-downloads", type=int, default=0,
+                        help="Maximum number of videos to download. (0 = unlimited)")
+    parser.add_argument("--stream-remux", action=argparse.BooleanOptionalAction,
+                        default=preferences[DataHandler.stream_remux_key],
+                        help="Remux audio while it downloads instead of buffering the whole file first.")
+    parser.add_argument("--as-discovered", action="store_true",
+                        help="Start downloading playlist entries while the playlist is still being listed.")
+    parser.add_argument("-l", "--limit", type=int, default=preferences[DataHandler.bandwidth_limit_key],
+                        help="Total download rate limit in KiB/s. (0 = unlimited)")
+    parser.add_argument("--adaptive", action=argparse.BooleanOptionalAction,
+                        default=preferences[DataHandler.adaptive_downloads_key],
+                        help="Tune the number of simultaneous downloads from the measured throughput, "
+                             "starting from --jobs.")
+    parser.add_argument("--async", dest="async_downloads", action=argparse.BooleanOptionalAction,
+                        default=preferences[DataHandler.async_downloads_key],
+                        help="Run every transfer on one event loop instead of a thread per download.")
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> int:
+    args = parse_args(argv)
+
+    if not os.path.exists(args.output):
+        print(f"Invalid folder path '{args.output}'.")
+        return 1
+    if not os.path.exists(args.ffmpeg):
+        print(f"Invalid file path '{args.ffmpeg}'.\nMake sure you select a valid ffmpeg executable.")
+        return 1
+
+    if args.async_downloads and args.adaptive:
+        print("Auto tuning isn't supported by async downloads, ignoring --adaptive.")
+
+    if args.async_downloads:
+        from AsyncDownloadEngine import AsyncDownloadEngine
+        engine_type = AsyncDownloadEngine
+    else:
+        engine_type = DownloadEngine
+
+    engine = engine_type(max(args.jobs, 1), stream_remux=args.stream_remux,
+                         max_processes=max(args.processes, 1), segments=max(args.segments, 1),
+                         adaptive=args.adaptive,
+                         config=DataHandler.get_config_snapshot({
+                             DataHandler.ffmpeg_key: args.ffmpeg,
+                             DataHandler.bandwidth_limit_key: max(args.limit, 0)
+                         }))
+    titles: dict[str, str] = {}
+
+    if args.as_discovered:
+        # Downloads start while the playlist is still being listed.
+        try:
+            entries = iter_link_entries(args.url)
+        except Exception as e:
+            print(f"Unable to get video or playlist from url '{args.url}'.\nReceived error {e}")
+            return 1
+
+        engine.submit_as_discovered(entries, args.output, limit=args.max_downloads)
+    else:
+        try:
+            videos = resolve_link(args.url).entries
+        except Exception as e:
+            print(f"Unable to get video or playlist from url '{args.url}'.\nReceived error {e}")
+            return 1
+
+        if args.max_downloads > 0:
+            videos = videos[:args.max_downloads]
+
+        for video in videos:
+            job = engine.submit(video.to_youtube(), args.output)
+            titles[job.uuid] = video.title or video.url
+
+    failed = 0
+    try:
+        for message in engine.messages():
+            if message.type == "discovered":
+                titles[message.uuid] = message.value
+                continue
+            if message.type != "event" or message.uuid not in titles:
+                continue
+
+            print(f"{titles[message.uuid]}: {message.value}")
+            if message.value in ("error", "canceled"):
+                failed += 1
+
+    except KeyboardInterrupt:
+        engine.stop()
+        for _ in engine.messages():
+            pass
+        return 130
+
+    finally:
+        engine.shutdown()
+
+    print(f"Finished {len(engine.jobs) - failed}/{len(engine.jobs)} downloads.")
+    return 0 if failed == 0 and len(engine.jobs) > 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
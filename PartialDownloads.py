@@ -0,0 +1,240 @@
+import json
+import os
+import threading
+import time
+from typing import BinaryIO, Final
+
+from AppDataHandler import DataHandler
+
+
+def split_into_segments(file_size: int, segments: int) -> list[tuple[int, int]]:
+    """
+    Splits a file into inclusive byte ranges of about the same size.
+    :param file_size: Size of the file in bytes.
+    :param segments: Number of ranges to make.
+    :return: The (start, end) pairs in order.
+    """
+    segments = max(1, min(segments, file_size))
+    segment_size = max(1, -(-file_size // segments))
+    return [(start, min(start + segment_size, file_size) - 1) for start in range(0, file_size, segment_size)]
+
+
+class PartialDownload:
+    """
+    A stream downloaded into a part file in the cache folder. A journal next to the part file records how much
+    of each byte range is done, so a canceled or failed download resumes where it stopped.
+    """
+    # Minimum time between journal writes while downloading, in seconds.
+    JOURNAL_INTERVAL: Final[float] = 1.0
+    # Files in the partial folder untouched for longer than this are deleted by cleanup, in seconds.
+    MAX_AGE: Final[float] = 7 * 24 * 60 * 60
+    # Cleanup deletes the oldest files until the partial folder is smaller than this, in bytes.
+    MAX_SIZE: Final[int] = 2 * 1024 * 1024 * 1024
+    # Files touched more recently than this may still be in use by another download, so cleanup keeps them.
+    MIN_AGE: Final[float] = 60 * 60
+
+    __active_keys: set[str] = set()
+    __active_keys_lock = threading.Lock()
+
+    def __init__(self, key: str, video_id: str, itag: int, file_size: int, segments: list[list[int]],
+                 resumable: bool = True):
+        """
+        :param key: Name of the part and journal files.
+        :param video_id: Id of the video the stream belongs to.
+        :param itag: Itag of the stream.
+        :param file_size: Size of the stream in bytes.
+        :param segments: [start, end, bytes done] for each inclusive byte range of the stream.
+        :param resumable: False if no later download can find the files, so they are deleted when closed.
+        """
+        folder = DataHandler.get_partial_download_dir()
+        self.key = key
+        self.video_id = video_id
+        self.itag = itag
+        self.file_size = file_size
+        self.segments = segments
+        self.part_path = os.path.join(folder, key + ".part")
+        self.journal_path = os.path.join(folder, key + ".json")
+        self.resumable = resumable
+        self.lock = threading.Lock()
+        self.last_journal_time = 0.0
+
+        mode = "r+b" if os.path.exists(self.part_path) else "w+b"
+        self.file: BinaryIO = open(self.part_path, mode)
+
+    @classmethod
+    def open(cls, video_id: str, itag: int, file_size: int, segments: int = 1) -> 'PartialDownload':
+        """
+        Opens the part file for the stream, resuming it if a matching journal exists.
+        :param video_id: Id of the video the stream belongs to.
+        :param itag: Itag of the stream.
+        :param file_size: Size of the stream in bytes.
+        :param segments: Number of byte ranges to split a new download into.
+        :return: The partial download.
+        """
+        os.makedirs(DataHandler.get_partial_download_dir(), exist_ok=True)
+        key = f"{video_id}_{itag}"
+        resumable = True
+
+        with cls.__active_keys_lock:
+            if key in cls.__active_keys:
+                # The same stream is already downloading in another thread, so this one can't be resumed.
+                key = f"{key}_{time.monotonic_ns()}"
+                resumable = False
+            cls.__active_keys.add(key)
+
+        folder = DataHandler.get_partial_download_dir()
+        journal = cls.read_journal(os.path.join(folder, key + ".json"))
+        if (journal is not None
+                and os.path.exists(os.path.join(folder, key + ".part"))
+                and journal.get("video_id") == video_id
+                and journal.get("itag") == itag
+                and journal.get("size") == file_size):
+            print(f"Resuming download of '{video_id}' at {journal['bytes_done']}/{file_size} bytes.")
+            return cls(key, video_id, itag, file_size, journal["segments"])
+
+        ranges = [[start, end, 0] for start, end in split_into_segments(file_size, segments)]
+        partial = cls(key, video_id, itag, file_size, ranges, resumable)
+        partial.file.truncate(0)
+        partial.save_journal(force=True)
+        return partial
+
+    @staticmethod
+    def read_journal(path: str) -> dict | None:
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, "r") as file:
+                return json.load(file)
+        except (json.JSONDecodeError, OSError):
+            print(f"Unable to parse journal '{path}'.")
+            return None
+
+    @property
+    def bytes_done(self) -> int:
+        return sum(done for _, _, done in self.segments)
+
+    def is_complete(self) -> bool:
+        return self.bytes_done == self.file_size
+
+    def remaining_ranges(self) -> list[tuple[int, int, int]]:
+        """
+        :return: (segment index, first byte left, last byte) for each unfinished segment.
+        """
+        return [(index, start + done, end)
+                for index, (start, end, done) in enumerate(self.segments)
+                if start + done <= end]
+
+    def write(self, index: int, chunk: bytes):
+        """Writes the next chunk of the segment. Safe to call from multiple threads."""
+        with self.lock:
+            start, end, done = self.segments[index]
+            self.file.seek(start + done)
+            self.file.write(chunk)
+            self.segments[index][2] = done + len(chunk)
+        self.save_journal()
+
+    def save_journal(self, force: bool = False):
+        """Writes the journal if JOURNAL_INTERVAL has passed since the last write, or always when forced."""
+        with self.lock:
+            if self.file.closed:
+                return
+
+            now = time.monotonic()
+            if not force and now - self.last_journal_time < self.JOURNAL_INTERVAL:
+                return
+
+            # Data has to be on disk before the journal claims it is.
+            self.file.flush()
+            journal = {
+                "video_id": self.video_id,
+                "itag": self.itag,
+                "size": self.file_size,
+                "bytes_done": self.bytes_done,
+                "segments": self.segments
+            }
+            temp_path = self.journal_path + ".tmp"
+            with open(temp_path, "w") as file:
+                json.dump(journal, file)
+            os.replace(temp_path, self.journal_path)
+            self.last_journal_time = now
+
+    def verify(self) -> bool:
+        """Checks that every segment is done and the part file has the size of the stream."""
+        self.file.flush()
+        return self.is_complete() and os.path.getsize(self.part_path) == self.file_size
+
+    def close_file(self):
+        """Saves the journal and closes the part file, keeping both on disk."""
+        if self.file.closed:
+            return
+
+        self.save_journal(force=True)
+        self.file.close()
+        with self.__active_keys_lock:
+            self.__active_keys.discard(self.key)
+
+    def close(self):
+        """
+        Closes the part file so the download can be resumed later.
+        Part files that can't be resumed are deleted instead.
+        """
+        if self.resumable:
+            self.close_file()
+        else:
+            self.delete()
+
+    def delete(self):
+        """Closes and removes the part file and its journal."""
+        self.close_file()
+        for path in (self.part_path, self.journal_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    @classmethod
+    def cleanup(cls):
+        """
+        Deletes files left in the partial folder by downloads that were never resumed. Files older than MAX_AGE are
+        deleted, then the oldest files until the folder is smaller than MAX_SIZE. Files of open downloads and files
+        touched in the last MIN_AGE are kept.
+        """
+        folder = DataHandler.get_partial_download_dir()
+        if not os.path.isdir(folder):
+            return
+
+        # The part file, journal and temporary journal of a download share the name before the first dot.
+        groups: dict[str, list] = {}
+        for entry in os.scandir(folder):
+            if not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            group = groups.setdefault(entry.name.split(".", 1)[0], [0.0, 0, []])
+            group[0] = max(group[0], stat.st_mtime)
+            group[1] += stat.st_size
+            group[2].append(entry.path)
+
+        with cls.__active_keys_lock:
+            active_keys = set(cls.__active_keys)
+
+        now = time.time()
+        total_size = sum(size for _, size, _ in groups.values())
+        deleted = 0
+        for key, (modified, size, paths) in sorted(groups.items(), key=lambda item: item[1][0]):
+            if key in active_keys or now - modified < cls.MIN_AGE:
+                continue
+            if now - modified < cls.MAX_AGE and total_size <= cls.MAX_SIZE:
+                continue
+
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    print(f"Unable to delete '{path}'.")
+            total_size -= size
+            deleted += 1
+
+        if deleted > 0:
+            print(f"Deleted {deleted} unfinished downloads from '{folder}'.")
@@ -1,19 +1,29 @@
-import queue
 import threading
-from typing import List
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from itertools import islice
+from typing import List, Final, TYPE_CHECKING
 
 import PyQt6
-import pytube
-from PyQt6.QtCore import QTimer
-from PyQt6.QtWidgets import QApplication, QPushButton, QLabel, QVBoxLayout, QHBoxLayout, QWidget, QListWidget, \
-    QProgressBar, QFormLayout
-
+from PyQt6.QtCore import QSortFilterProxyModel, Qt, QItemSelection, QItemSelectionModel
+from PyQt6.QtWidgets import QApplication, QPushButton, QLabel, QVBoxLayout, QHBoxLayout, QWidget, QListView, \
+    QProgressBar, QFormLayout, QLineEdit
 import AppDataHandler
-from CustomWidgets import LabeledCheckbox
+from CustomWidgets import LabeledCheckbox, StreamListModel, StreamRow
 from DownloadHandler import DownloadRequest
+from LinkResolver import VideoEntry
+from MessageBridge import MessageBridge
+
+if TYPE_CHECKING:
+    from pytube import YouTube
 
 
 class StreamViewer(QWidget):
+    # Number of videos looked up at the same time while populating the list.
+    PREFETCH_WORKERS: Final[int] = 8
+    # Number of lookups started ahead of the next video to add.
+    PREFETCH_WINDOW: Final[int] = 32
+
     def __init__(self):
         super().__init__()
 
@@ -25,9 +35,8 @@ class StreamViewer(QWidget):
         self.video_list_gen_thread = None
         self.stop_video_list_generation_event = threading.Event()
         self.progress_bar = QProgressBar()
-        self.video_queue = queue.Queue()
-        self.update_timer = QTimer(self)
-        self.update_timer.timeout.connect(self.check_messages)
+        self.video_queue = MessageBridge(self)
+        self.video_queue.messages_received.connect(self.on_messages_received)
 
         # Buttons
         self.cancel_btn = QPushButton("Return To Home")
@@ -50,13 +59,32 @@ class StreamViewer(QWidget):
                 AppDataHandler.DataHandler.audio_only_key,
                 self.audio_only_toggle.check_box.isChecked()))
 
+        self.stream_remux_toggle = LabeledCheckbox("Remux While Downloading?", False)
+        self.stream_remux_toggle.check_box.setChecked(
+            AppDataHandler.DataHandler.get_config_file_info()[AppDataHandler.DataHandler.stream_remux_key])
+        self.stream_remux_toggle.check_box.stateChanged.connect(lambda:
+            AppDataHandler.DataHandler.update_config_file(
+                AppDataHandler.DataHandler.stream_remux_key,
+                self.stream_remux_toggle.check_box.isChecked()))
+
         self.select_toggle = QPushButton("Toggle Select")
         self.select_toggle.setStyleSheet("padding: 5px")
         self.select_toggle.clicked.connect(self.toggle_select)
 
-        self.stream_list_view = QListWidget()
+        self.filter_input = QLineEdit()
+        self.filter_input.setPlaceholderText("Filter")
+        self.filter_input.setClearButtonEnabled(True)
+
+        self.stream_list_model = StreamListModel(self)
+        self.stream_filter_model = QSortFilterProxyModel(self)
+        self.stream_filter_model.setSourceModel(self.stream_list_model)
+        self.stream_filter_model.setFilterCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+        self.filter_input.textChanged.connect(self.stream_filter_model.setFilterFixedString)
+
+        self.stream_list_view = QListView()
+        self.stream_list_view.setModel(self.stream_filter_model)
+        self.stream_list_view.setUniformItemSizes(True)
         self.stream_list_view.setSelectionMode(PyQt6.QtWidgets.QAbstractItemView.SelectionMode.MultiSelection)
-        self.stream_id_youtube_map = {}
 
         # Layout
         column_2 = QVBoxLayout()
@@ -66,11 +94,13 @@ class StreamViewer(QWidget):
         row_1 = QHBoxLayout()
         row_1.addWidget(QLabel("To Download"))
         row_1.addWidget(self.audio_only_toggle)
+        row_1.addWidget(self.stream_remux_toggle)
         row_1.addWidget(self.select_toggle)
         row_1.addWidget(self.cancel_btn)
 
         column_1 = QVBoxLayout()
         column_1.addLayout(row_1)
+        column_1.addWidget(self.filter_input)
         column_1.addWidget(self.stream_list_view)
         column_1.addWidget(self.progress_bar)
 
@@ -91,9 +121,8 @@ class StreamViewer(QWidget):
     def on_cancel(self):
         print("Returning to home.")
         self.stop_video_list_generation_event.set()
-        self.update_timer.stop()
 
-        if self.video_list_gen_thread.is_alive():
+        if self.video_list_gen_thread is not None and self.video_list_gen_thread.is_alive():
             self.video_list_gen_thread.join()
 
         for callback in self.on_cancel_callback:
@@ -108,13 +137,12 @@ class StreamViewer(QWidget):
 
         # Create download list.
         download_list: List[DownloadRequest] = []
-        for selected_item in self.stream_list_view.selectedItems():
-            video_id = int(selected_item.text().split('.', maxsplit = 1)[0])
-            video = self.stream_id_youtube_map[video_id]
-            audio_only = self.audio_only_toggle.get_value()
-            output_path = self.output_path
-
-            download_list.append(DownloadRequest(video_id, video, audio_only, output_path))
+        audio_only = self.audio_only_toggle.get_value()
+        video_ids = sorted(index.data(StreamListModel.VideoIdRole)
+                           for index in self.stream_list_view.selectionModel().selectedRows())
+        for video_id in video_ids:
+            row = self.stream_list_model.get_row(video_id)
+            download_list.append(DownloadRequest(video_id, row.video, audio_only, self.output_path, row.title))
 
         for callback in self.on_start_downloads_callback:
             callback(download_list)
@@ -122,73 +150,119 @@ class StreamViewer(QWidget):
     def toggle_select(self):
         print("Toggling select.")
 
-        if len(self.stream_list_view.selectedItems()) > 0:
+        if self.stream_list_view.selectionModel().hasSelection():
             print("Removing selections.")
             self.stream_list_view.clearSelection()
         else:
-            self.stream_list_view.selectAll()
+            self.select_all()
 
-    def set_video_list(self, videos: List[pytube.YouTube], output_path: str):
+    def select_all(self):
+        """Selects every visible row with a single selection range."""
+        row_count = self.stream_filter_model.rowCount()
+        if row_count == 0:
+            return
+
+        selection = QItemSelection(self.stream_filter_model.index(0, 0),
+                                   self.stream_filter_model.index(row_count - 1, 0))
+        self.stream_list_view.selectionModel().select(selection, QItemSelectionModel.SelectionFlag.ClearAndSelect)
+
+    def set_video_list(self, videos: List[VideoEntry], output_path: str):
         print("Setting url list.")
         self.begin_btn.setEnabled(False)
         self.output_path = output_path
 
-        while not self.video_queue.empty():
-            self.video_queue.get()
-
-        self.update_timer.stop()
+        self.video_queue.clear()
         self.stop_video_list_generation_event.clear()
         self.progress_bar.setValue(0)
-        self.stream_id_youtube_map = {}
-        self.stream_list_view.clear()
+        self.filter_input.clear()
+        self.stream_list_model.clear()
         self.video_list_gen_thread = threading.Thread(target=self.populate_video_list, args=(videos, self.video_queue))
         self.video_list_gen_thread.daemon = True
         self.video_list_gen_thread.start()
-        self.update_timer.start(100)
 
-    def check_messages(self):
-        while not self.video_queue.empty():
-            self.on_message_received(self.video_queue.get())
+    def on_messages_received(self, messages: List[dict]):
+        # Add every video in the batch at once.
+        rows: List[StreamRow] = []
+        stop_message = None
+        for message in messages:
+            if "Stop Message" in message.keys():
+                stop_message = message
+                continue
 
-    def on_message_received(self, message: dict):
-        if "Stop Message" in message.keys():
+            rows.append(StreamRow(message["ID"], message["YouTube"], message["Title"], message["Author"]))
+            self.progress_bar.setValue(message["Progress"])
+
+        self.stream_list_model.add_rows(rows)
+
+        if stop_message is not None:
             # perform cleanup
             print("Received stop message.")
-            if message["Stop Message"] == "Finished":
-                self.stream_list_view.selectAll()
+            if stop_message["Stop Message"] == "Finished":
+                self.select_all()
                 self.begin_btn.setEnabled(True)
                 self.begin_btn.setFocus()
-            return
-
-        self.stream_id_youtube_map[message["ID"]] = message["YouTube"]
-        self.stream_list_view.addItem(f"{message["ID"]}. {message["Title"]} - {message["Author"]}")
-        self.progress_bar.setValue(message["Progress"])
 
-    def populate_video_list(self, videos: List[pytube.YouTube], result_queue: queue):
+    def populate_video_list(self, videos: List[VideoEntry], result_queue: MessageBridge):
         print("Beginning population.")
 
-        video_count = 1
         total_videos = len(videos)
         print(total_videos)
-        for video in videos:
-            if self.stop_video_list_generation_event.is_set():
-                print("Stopping video retrieval.")
-                result_queue.put({
-                    "Stop Message": "Canceled"
-                })
-                return
-            print(f"Adding {video.title} to list.")
-
-            message = {
-                "ID": video_count,
-                "YouTube": video,
-                "Title": video.title,
-                "Author": video.author,
-                "Progress": int(video_count / total_videos * 100)
-            }
-            result_queue.put(message)
-            video_count += 1
+        video_iterator = iter(videos)
+        pending: deque[Future] = deque()
+
+        def resolve(entry: VideoEntry) -> tuple['YouTube', str, str]:
+            video = entry.to_youtube()
+            if entry.title and entry.author:
+                return video, entry.title, entry.author
+
+            # Only needed when the listing left out the title or author. Both properties request the video page.
+            return video, entry.title or video.title, entry.author or video.author
+
+        executor = ThreadPoolExecutor(max_workers=self.PREFETCH_WORKERS)
+        try:
+            # Keep a bounded window of lookups running and add the results in playlist order.
+            for video in islice(video_iterator, self.PREFETCH_WINDOW):
+                pending.append(executor.submit(resolve, video))
+
+            video_count = 1
+            while len(pending) > 0:
+                future = pending[0]
+                while True:
+                    if self.stop_video_list_generation_event.is_set():
+                        print("Stopping video retrieval.")
+                        result_queue.put({
+                            "Stop Message": "Canceled"
+                        })
+                        return
+                    try:
+                        video, title, author = future.result(timeout=0.1)
+                        break
+                    except FutureTimeoutError:
+                        continue
+                    except Exception as e:
+                        video, title, author = None, None, None
+                        print(f"Unable to get video {video_count}. {e}")
+                        break
+
+                pending.popleft()
+                next_video = next(video_iterator, None)
+                if next_video is not None:
+                    pending.append(executor.submit(resolve, next_video))
+
+                if video is not None:
+                    print(f"Adding {title} to list.")
+                    result_queue.put({
+                        "ID": video_count,
+                        "YouTube": video,
+                        "Title": title,
+                        "Author": author,
+                        "Progress": int(video_count / total_videos * 100)
+                    })
+                video_count += 1
+
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
         result_queue.put({
             "Stop Message": "Finished"
-        })
\ No newline at end of file
+        })
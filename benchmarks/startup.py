@@ -0,0 +1,69 @@
+"""
+Measures how long Music Maker takes to start. Each run uses a new interpreter, so nothing is already imported.
+
+Usage: python benchmarks/startup.py [runs]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that should not be imported before the first window is painted.
+HEAVY_MODULES = ("pytube", "yt_dlp", "ffmpeg", "mutagen", "DownloadEngine", "DownloadHelpers")
+
+RUN_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+
+from PyQt6.QtWidgets import QApplication
+app = QApplication([])
+qt_ready = time.perf_counter()
+
+from HomeWindow import MainWindow
+imported = time.perf_counter()
+
+window = MainWindow()
+window.show()
+window.repaint()
+app.processEvents()
+painted = time.perf_counter()
+
+print(json.dumps({
+    "qt": qt_ready - start,
+    "import": imported - qt_ready,
+    "first paint": painted - start,
+    "heavy modules": [name for name in HEAVY_MODULES if name in sys.modules]
+}))
+"""
+
+
+def run_once() -> dict:
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    script = f"HEAVY_MODULES = {HEAVY_MODULES!r}\n{RUN_SCRIPT}"
+    result = subprocess.run([sys.executable, "-c", script], cwd=REPOSITORY_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    # The app prints its own logging, the measurements are the last line.
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    results = [run_once() for _ in range(runs)]
+
+    for key in ("qt", "import", "first paint"):
+        times = [result[key] * 1000 for result in results]
+        print(f"{key:>12}: median {statistics.median(times):8.1f} ms, min {min(times):8.1f} ms")
+
+    heavy_modules = sorted(set(name for result in results for name in result["heavy modules"]))
+    if len(heavy_modules) > 0:
+        print(f"Imported before first paint: {', '.join(heavy_modules)}")
+    else:
+        print("No download backends imported before first paint.")
+
+
+if __name__ == "__main__":
+    main()
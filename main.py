@@ -1,11 +1,34 @@
+import threading
+
+from PyQt6.QtCore import QTimer
 from PyQt6.QtWidgets import QApplication
 
 from HomeWindow import MainWindow
 
+# Imports the download backends in the background once the window is shown, so Get Streams doesn't wait for them.
+WARM_UP_IMPORTS = True
+
+
+def warm_up_imports():
+    """Imports the modules that are only needed once streams are requested."""
+    print("Warming up download backends.")
+    try:
+        import LinkResolver
+        import yt_dlp
+        import DownloadEngine
+    except ImportError as e:
+        print(f"Unable to warm up download backends. {e}")
+        return
+    print("Download backends ready.")
+
+
 if __name__ == "__main__":
     app = QApplication([])
 
     window = MainWindow()
     window.show()
 
+    if WARM_UP_IMPORTS:
+        QTimer.singleShot(0, lambda: threading.Thread(target=warm_up_imports, daemon=True).start())
+
     app.exec()